@@ -2,18 +2,27 @@
 import json
 import logging
 import os.path
+import queue
+import threading
 import time
 from contextlib import nullcontext
+from textwrap import dedent
 from urllib.parse import urlparse
 
+import requests
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.common.exceptions import (
-    NoSuchElementException, NoSuchWindowException)
+    JavascriptException, NoSuchElementException, NoSuchWindowException,
+    StaleElementReferenceException, TimeoutException,
+    UnexpectedAlertPresentException, WebDriverException)
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
+from _trace import CommandTracer
+
 logger = None
 
 
@@ -84,16 +93,174 @@ def try_find(find_fn, *args, **kwargs):
         return None
 
 
+class RequestScheduler:
+    """Token bucket limiting the rate of requests to LibraryThing.
+
+    Tokens are added at a sustained rate of ``rate`` per second, up to a
+    maximum of ``burst``. A rate of 0 disables rate limiting.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a request may be made."""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens
+                              + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            # Reserve a token even if none are available, so that waiting
+            # requests are served in order
+            self.tokens -= 1
+            delay = -self.tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
 class LibraryThingRobot:
     """Base class for automation of LibraryThing flows."""
 
+    # Cookies of the first successful login, shared with other sessions
+    shared_cookies = None
+
+    # Rate limiter shared by all sessions
+    scheduler = RequestScheduler(0, 1)
+
+    # Whether the browser supports event-driven waits
+    event_waits = True
+
+    # Tracer of WebDriver commands, if enabled
+    tracer = None
+
     def __init__(self, config, driver):
         self.config = config
         self.driver = driver
+        # URL of the current page, if it hasn't been changed since it loaded
+        self.clean_url = None
+        self.script_timeout = None
+
+    def traced(self, kind):
+        """Record the duration of a block of code, if tracing is enabled."""
+        return self.tracer.span(kind) if self.tracer else nullcontext()
 
     def wait_until(self, condition, seconds=10):
         """Wait up to 10 seconds for the given wait condition."""
-        return WebDriverWait(self.driver, seconds).until(condition)
+        with self.traced('wait'):
+            return WebDriverWait(self.driver, seconds).until(condition)
+
+    # Calls the condition whenever the document changes or an ajax request
+    # completes, and also on a short timer for changes that don't trigger
+    # any events, e.g. to jQuery.active. Returns {result: ...} when the
+    # condition holds, {error: ...} if it throws, or {} on timeout.
+    wait_script = dedent("""\
+        const [body, args, timeout] = arguments;
+        const done = arguments[arguments.length - 1];
+        const condition = new Function(body);
+        let finished = false;
+        const check = () => {
+            if (finished) {
+                return;
+            }
+            let result;
+            try {
+                result = condition.apply(null, args);
+            } catch (e) {
+                finish({error: String(e)});
+                return;
+            }
+            if (result) {
+                finish({result: result});
+            }
+        };
+        const observer = new MutationObserver(check);
+        const interval = setInterval(check, 50);
+        const timer = setTimeout(() => finish({}), timeout);
+        const finish = result => {
+            finished = true;
+            observer.disconnect();
+            clearInterval(interval);
+            clearTimeout(timer);
+            if (window.jQuery) {
+                jQuery(document).off('ajaxComplete ajaxStop', check);
+            }
+            done(result);
+        };
+        observer.observe(document, {attributes: true, childList: true,
+                                    characterData: true, subtree: true});
+        if (window.jQuery) {
+            jQuery(document).on('ajaxComplete ajaxStop', check);
+        }
+        check();""")
+
+    def set_script_timeout(self, seconds):
+        """Set the timeout for asynchronous scripts, if it has changed."""
+        if self.script_timeout != seconds:
+            self.driver.set_script_timeout(seconds)
+            self.script_timeout = seconds
+
+    # Errors of a single wait, rather than of the event-driven wait mechanism
+    wait_call_errors = (TimeoutException, StaleElementReferenceException,
+                        NoSuchWindowException, UnexpectedAlertPresentException)
+
+    def execute_wait_script(self, script, *args, seconds):
+        """Run an asynchronous script which waits for the page to change.
+
+        Returns the result of the script, or None if event-driven waits are
+        disabled or don't work, in which case the caller should poll instead.
+        """
+        if not self.event_waits or self.config.no_event_waits:
+            return None
+        self.set_script_timeout(seconds + 5)
+        try:
+            with self.traced('wait'):
+                return self.driver.execute_async_script(script, *args)
+        except self.wait_call_errors:
+            raise
+        except WebDriverException:
+            logger.warning("Event-driven wait failed, falling back to "
+                           "polling", exc_info=True)
+            LibraryThingRobot.event_waits = False
+            return None
+
+    def wait_for_script(self, script, *args, seconds=10):
+        """Wait until a script returns a true value.
+
+        The script is re-run in the browser whenever the page changes, so the
+        wait ends as soon as the condition holds. If this isn't supported, the
+        script is polled instead.
+        """
+        outcome = self.execute_wait_script(
+            self.wait_script, script, list(args), seconds * 1000,
+            seconds=seconds)
+        if outcome is not None:
+            if 'error' in outcome:
+                raise JavascriptException(
+                    f"{outcome['error']} in wait script: {script}")
+            if 'result' not in outcome:
+                raise TimeoutException(
+                    f"Timed out waiting for script: {script}")
+            return outcome['result']
+        return self.wait_until(
+            lambda wd: wd.execute_script(script, *args), seconds)
+
+    def wait_for_class(self, elt, name, present=True):
+        """Wait until an element has, or doesn't have, a CSS class."""
+        return self.wait_for_script(
+            "return arguments[0].classList.contains(arguments[1])"
+            " === arguments[2];", elt, name, present)
+
+    def wait_for_style(self, elt, name, value):
+        """Wait until an inline style of an element has the given value."""
+        return self.wait_for_script(
+            "return arguments[0].style.getPropertyValue(arguments[1])"
+            " === arguments[2];", elt, name, value)
 
     def wait_for_lb(self):
         """Wait for the lightbox to appear and load."""
@@ -111,13 +278,39 @@ class LibraryThingRobot:
         lb_close.click()
         self.wait_until(EC.invisibility_of_element(lb_content))
 
+    def url(self, path):
+        """Get the full URL of a LibraryThing page."""
+        return f'{self.config.base_url}{path}'
+
+    def navigate(self, url, reuse=False):
+        """Load a new page.
+
+        If ``reuse`` is set, the page is not reloaded if it is already loaded
+        and hasn't been changed since.
+        """
+        if reuse and url == self.clean_url:
+            logger.debug("Reusing current page %s", url)
+            return
+        self.scheduler.acquire()
+        self.driver.get(url)
+        self.clean_url = url
+
+    def click_ajax(self, elt, message, *args):
+        """Click an element that triggers an ajax request."""
+        logger.debug(message, *args)
+        self.clean_url = None
+        self.scheduler.acquire()
+        elt.click()
+
     def click_link(self, elt, message, *args):
         """Click an element and wait for a new page to load."""
         html = self.driver.find_element_by_tag_name('html')
         logger.debug(message, *args)
+        self.scheduler.acquire()
         elt.click()
         self.wait_until(EC.staleness_of(html))
         self.wait_until(page_loaded_condition, 30)
+        self.clean_url = self.driver.current_url
 
     def user_alert(self, message):
         """Display an alert to the user."""
@@ -139,14 +332,18 @@ class LibraryThingRobot:
         """Log in to LibraryThing."""
         driver = self.driver
         cookies_file = self.config.cookies_file
-        driver.get('https://www.librarything.com')
-        if cookies_file and os.path.exists(cookies_file):
+        self.navigate(self.url('/'))
+        cookies = self.shared_cookies
+        if cookies:
+            logger.debug("Using cookies from existing session")
+        elif cookies_file and os.path.exists(cookies_file):
             logger.debug("Loading cookies from %r", cookies_file)
             with open(cookies_file) as f:
                 cookies = json.load(f)
+        if cookies:
             for cookie in cookies:
                 driver.add_cookie(cookie)
-            driver.get('https://www.librarything.com/home')
+            self.navigate(self.url('/home'))
         if not urlparse(driver.current_url).path == '/home':
             self.user_alert("[LTJI] Log in and complete robot check")
             logger.debug("Waiting for user login")
@@ -154,11 +351,38 @@ class LibraryThingRobot:
                 lambda wd: urlparse(wd.current_url).path == '/home', 180)
         logger.debug("Login successful")
         self.close_gdpr_banner()
+        cookies = driver.get_cookies()
+        LibraryThingRobot.shared_cookies = cookies
         if cookies_file:
             with open(cookies_file, 'w') as f:
-                json.dump(driver.get_cookies(), f)
+                json.dump(cookies, f)
             logger.debug("Saved cookies to %r", cookies_file)
 
+    def get_username(self):
+        """Get the name of the logged in user from the login cookies."""
+        for cookie in self.shared_cookies or ():
+            if cookie['name'] == 'cookie_userid':
+                return cookie['value']
+        return None
+
+
+def http_session():
+    """Create a pooled HTTP session."""
+    session = requests.Session()
+    # Retry failed connections; idle connections are kept open for reuse
+    adapter = HTTPAdapter(max_retries=3)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def add_session_cookies(session, cookies):
+    """Add cookies from a WebDriver session to an HTTP session."""
+    for cookie in cookies:
+        session.cookies.set(cookie['name'], cookie['value'],
+                            domain=cookie.get('domain', ''),
+                            path=cookie.get('path', '/'))
+
 
 # Map from browser name to WebDriver class
 DRIVERS = {
@@ -183,43 +407,247 @@ def iter_books(data, book_ids):
         yield from data.items()
 
 
-def main_loop(config, data, verb, init_fn, process_fn):
-    """Main processing loop of script."""
+class Journal:
+    """Append-only file of JSON records, one per line."""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'a' if resume else 'w')
+        if resume and os.path.getsize(path):
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                partial = f.read() != b'\n'
+            if partial:
+                # Terminate a record cut short by a crash, so that it isn't
+                # joined with the next record
+                self.file.write('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, record):
+        """Write a record and flush it to disk."""
+        line = json.dumps(record)
+        with self.lock:
+            self.file.write(line)
+            self.file.write('\n')
+            self.file.flush()
+
+    def close(self):
+        """Close the journal file."""
+        self.file.close()
+
+    @staticmethod
+    def replay(path):
+        """Yield the records of an existing journal file."""
+        with open(path) as f:
+            for lineno, line in enumerate(f, 1):
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Probably a partial write due to a crash
+                    logger.warning("Ignoring invalid record at %s:%d",
+                                   path, lineno)
+
+
+class LookupCache:
+    """Persistent cache of lookup tables discovered from the website.
+
+    Tables are saved to a JSON file along with the time they were stored, and
+    expire after ``ttl_days``. With no path, tables are only kept in memory.
+    The tables describe a single LibraryThing account, so the file is ignored
+    if it was saved for another ``account``.
+    """
+
+    version = 1
+
+    def __init__(self, path=None, ttl_days=None, account=None):
+        self.path = path
+        self.ttl = ttl_days * 86400 if ttl_days else None
+        self.account = account
+        self.lock = threading.Lock()
+        self.tables = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                cache_data = json.load(f)
+            if cache_data.get('version') != self.version:
+                logger.info("Ignoring cache file %r with old version", path)
+            elif cache_data.get('account') != account:
+                logger.info("Ignoring cache file %r of account %r", path,
+                            cache_data.get('account'))
+            else:
+                self.tables = cache_data['tables']
+
+    def get(self, name, default=None):
+        """Get the data of a cached table, if present and not expired."""
+        with self.lock:
+            entry = self.tables.get(name)
+        if not entry:
+            return default
+        if self.ttl and time.time() - entry['timestamp'] > self.ttl:
+            logger.debug("Cached table %r has expired", name)
+            return default
+        return entry['data']
+
+    def put(self, name, data):
+        """Store a table and save the cache file."""
+        with self.lock:
+            self.tables[name] = {'timestamp': time.time(), 'data': data}
+            self.save()
+
+    def save(self):
+        """Write the cache file."""
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.version, 'account': self.account,
+                       'tables': self.tables}, f)
+        os.replace(tmp_path, self.path)
+
+
+class LoopState:
+    """Counters and error log shared by the workers of the main loop."""
+
+    def __init__(self, config, verb, errors_file):
+        self.config = config
+        self.verb = verb
+        self.errors_file = errors_file
+        self.lock = threading.Lock()
+        self.abort = threading.Event()
+        self.processed = 0
+        self.errors = 0
+        self.failed_workers = 0
+
+    def record_success(self, book_id):
+        """Record a successfully processed book."""
+        with self.lock:
+            self.processed += 1
+
+    def record_error(self, book_id):
+        """Record a book that could not be processed."""
+        with self.lock:
+            if self.errors_file:
+                self.errors_file.write(book_id)
+                self.errors_file.write('\n')
+                self.errors_file.flush()
+            self.errors += 1
+            if self.config.debug_mode:
+                input("\aPress enter to continue: ")
+
+
+def process_books(state, ltrobot, books, process_fn):
+    """Process books from the work queue until it is empty."""
+    while not state.abort.is_set():
+        try:
+            book_id, book_data = books.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            with (ltrobot.tracer.book(book_id) if ltrobot.tracer
+                  else nullcontext()):
+                process_fn(ltrobot, book_id, book_data)
+        except NoSuchWindowException:
+            raise  # Fatal error, abort
+        except Exception:
+            logger.warning("Failed to %s book %s", state.verb, book_id,
+                           exc_info=True)
+            state.record_error(book_id)
+            # The failure may have left the current page in any state
+            ltrobot.clean_url = None
+        else:
+            state.record_success(book_id)
+
+
+def trace_session(session):
+    """Trace the commands of a WebDriver session, if tracing is enabled."""
+    if LibraryThingRobot.tracer and isinstance(session, WebDriver):
+        LibraryThingRobot.tracer.wrap_driver(session)
+
+
+def run_worker(config, state, books, session_fn, init_fn, process_fn):
+    """Process books in a separate session."""
+    try:
+        with session_fn() as session:
+            trace_session(session)
+            ltrobot = init_fn(session)
+            process_books(state, ltrobot, books, process_fn)
+    except Exception:
+        logger.error("Worker %s failed with exception",
+                     threading.current_thread().name, exc_info=True)
+        with state.lock:
+            state.failed_workers += 1
+
+
+def main_loop(config, data, verb, init_fn, process_fn, skip_fn=None,
+              session_fn=None):
+    """Main processing loop of script.
+
+    Each worker opens a session with ``session_fn`` (by default, a WebDriver
+    for the configured browser) and passes it to ``init_fn`` to create a robot.
+    """
+    session_fn = session_fn or DRIVERS[config.browser]
     success = False
-    processed = 0
-    errors = 0
-    with DRIVERS[config.browser]() as driver:
+    books = queue.Queue()
+    skipped = 0
+    for book_id, book_data in iter_books(data, config.book_ids):
+        if skip_fn and skip_fn(book_id, book_data):
+            skipped += 1
+        else:
+            books.put((book_id, book_data))
+    if skipped:
+        logger.info("Skipping %d books, %d remaining", skipped, books.qsize())
+    workers = []
+    LibraryThingRobot.scheduler = RequestScheduler(config.rate, config.burst)
+    if config.trace_stats or config.trace_file:
+        LibraryThingRobot.tracer = CommandTracer(
+            LibraryThingRobot, trace_events=bool(config.trace_file))
+        LibraryThingRobot.tracer.start_profiling()
+    with session_fn() as session:
+        trace_session(session)
         try:
-            ltrobot = init_fn(driver)
+            # Initialize the first session before starting other workers, so
+            # they can reuse its login cookies
+            ltrobot = init_fn(session)
             with (open(config.errors_file, 'w') if config.errors_file
                   else nullcontext()) as ef:
-                for book_id, book_data in iter_books(data, config.book_ids):
-                    time.sleep(1)
-                    try:
-                        process_fn(ltrobot, book_id, book_data)
-                    except NoSuchWindowException:
-                        raise  # Fatal error, abort
-                    except Exception:
-                        logger.warning("Failed to %s book %s", verb, book_id,
-                                       exc_info=True)
-                        if ef:
-                            ef.write(book_id)
-                            ef.write('\n')
-                            ef.flush()
-                        errors += 1
-                        if config.debug_mode:
-                            input("\aPress enter to continue: ")
-                    else:
-                        processed += 1
+                state = LoopState(config, verb, ef)
+                for i in range(1, config.workers):
+                    worker = threading.Thread(
+                        target=run_worker, name=f'worker-{i}',
+                        args=(config, state, books, session_fn, init_fn,
+                              process_fn))
+                    worker.start()
+                    workers.append(worker)
+                try:
+                    process_books(state, ltrobot, books, process_fn)
+                except BaseException:
+                    # Let other workers finish their current book and exit
+                    state.abort.set()
+                    raise
+                finally:
+                    for worker in workers:
+                        worker.join()
             logger.info("%d books %sed, %d errors (%d total)",
-                        processed, verb, errors, processed + errors)
-            success = True
+                        state.processed, verb, state.errors,
+                        state.processed + state.errors)
+            success = not state.failed_workers
         except KeyboardInterrupt:
             logger.info("Interrupted, exiting")
         except Exception:
             logger.error("%s failed with exception", verb.capitalize(),
                          exc_info=True)
         finally:
+            tracer = LibraryThingRobot.tracer
+            if tracer:
+                tracer.stop_profiling()
+                tracer.report(config.trace_stats)
+                if config.trace_file:
+                    tracer.write_trace(config.trace_file)
             if config.debug_mode:
                 input("\aPress enter to exit: ")
 
@@ -237,6 +665,28 @@ def add_common_flags(parser):
     parser.add_argument('-i', '--book-ids',
                         help="Comma-separated list of book ids to process, or "
                         "@filename to read ids from file")
+    parser.add_argument('-w', '--workers', type=positive_int, default=1,
+                        help="Number of browser sessions to run in parallel")
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help="Maximum sustained rate of page loads and ajax "
+                        "requests per second, shared by all workers, or 0 for "
+                        "no limit (default: 1)")
+    parser.add_argument('--burst', type=positive_int, default=5,
+                        help="Maximum number of requests to allow in a burst "
+                        "above the sustained rate")
+    parser.add_argument('--base-url', default='https://www.librarything.com',
+                        help="Base URL of the LibraryThing website")
+    parser.add_argument('--trace-stats', metavar='FILE',
+                        help="Record the time spent in WebDriver commands and "
+                        "waits by method, and write statistics for each "
+                        "book and the whole run to this file")
+    parser.add_argument('--trace-file', metavar='FILE',
+                        help="Write a trace of book processing steps, waits "
+                        "and WebDriver commands to this file, in Chrome Trace "
+                        "Event format")
+    parser.add_argument('--no-event-waits', action='store_true',
+                        help="Poll for page changes instead of waiting for "
+                        "events in the browser")
     parser.add_argument('-v', '--verbose', action='store_true',
                         help="Log additional debugging information.")
     parser.add_argument('-d', '--debug-mode', action='store_true',
@@ -252,6 +702,14 @@ def init_logging(config, name):
         logger.setLevel(logging.DEBUG)
 
 
+def positive_int(value):
+    """Parse a positive integer command-line argument."""
+    n = int(value)
+    if n < 1:
+        raise ValueError(f"Expected a positive integer: {value!r}")
+    return n
+
+
 def parse_list(value):
     """Parse a list of values separated by commas or whitespace."""
     return [w for v in value.split(',') for w in v.split()] if value else []
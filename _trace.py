@@ -0,0 +1,238 @@
+"""Instrumentation of WebDriver commands for performance analysis."""
+import json
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger('trace')
+
+# Robot methods which run the steps of processing a book. Commands are
+# attributed to the step method called by one of these, e.g. set_format.
+FLOW_METHODS = {'process_book', 'add_book', 'create_book', 'set_book_fields'}
+
+
+def percentile(values, p):
+    """Get the p-th percentile of a sorted list, by nearest rank."""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Stats:
+    """Durations and sizes of a kind of traced event."""
+
+    def __init__(self):
+        self.durations = []
+        self.bytes = 0
+
+    def add(self, duration, size=0):
+        self.durations.append(duration)
+        self.bytes += size
+
+    def merge(self, other):
+        self.durations.extend(other.durations)
+        self.bytes += other.bytes
+
+    def summary(self):
+        durations = sorted(self.durations)
+        return {
+            'count': len(durations),
+            'total': round(sum(durations), 3),
+            'p50': round(percentile(durations, 50), 3),
+            'p95': round(percentile(durations, 95), 3),
+            'bytes': self.bytes,
+        }
+
+
+class CommandTracer:
+    """Record WebDriver commands and waits, by the robot method causing them.
+
+    Events are grouped by (method, kind), where kind is the WebDriver command
+    name or the name of a span such as 'wait'. Statistics are kept for each
+    book and for the whole run.
+
+    If ``trace_events`` is set, each book, robot method call, wait and command
+    is also kept as a span in Chrome Trace Event format, which can be loaded
+    into a trace viewer such as Perfetto.
+    """
+
+    def __init__(self, robot_class, trace_events=False):
+        self.robot_class = robot_class
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.run_stats = defaultdict(Stats)
+        self.book_stats = {}
+        self.start = time.perf_counter()
+        self.events = [] if trace_events else None
+
+    def caller_method(self):
+        """Find the robot method to which the current event is attributed."""
+        frame = sys._getframe(1)
+        method = None
+        while frame:
+            if isinstance(frame.f_locals.get('self'), self.robot_class):
+                name = frame.f_code.co_name
+                if name in FLOW_METHODS:
+                    return method or name
+                method = name
+            frame = frame.f_back
+        return method or '(other)'
+
+    def add_event(self, name, cat, start, end, **args):
+        """Add a complete span to the trace, if enabled."""
+        if self.events is None:
+            return
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': round((start - self.start) * 1e6),
+            'dur': round((end - start) * 1e6),
+            'pid': 1,
+            'tid': threading.get_ident(),
+        }
+        if args:
+            event['args'] = args
+        with self.lock:
+            self.events.append(event)
+
+    def profile(self, frame, event, arg):
+        """Profile function which traces calls of robot methods."""
+        if event == 'call':
+            if isinstance(frame.f_locals.get('self'), self.robot_class):
+                self.local.calls.append((frame, time.perf_counter()))
+        elif event == 'return':
+            calls = self.local.calls
+            if calls and calls[-1][0] is frame:
+                _, start = calls.pop()
+                self.add_event(frame.f_code.co_name, 'method', start,
+                               time.perf_counter())
+
+    def start_thread(self, *args):
+        """Start tracing robot method calls in the current thread."""
+        self.local.calls = []
+        sys.setprofile(self.profile)
+        return self.profile(*args) if args else None
+
+    def start_profiling(self):
+        """Trace robot method calls in this and any new threads."""
+        if self.events is not None:
+            self.start_thread()
+            threading.setprofile(self.start_thread)
+
+    def stop_profiling(self):
+        """Stop tracing robot method calls."""
+        sys.setprofile(None)
+        threading.setprofile(None)
+
+    def record(self, method, kind, duration, size=0):
+        """Record an event for the current book and the run."""
+        key = method, kind
+        stats = getattr(self.local, 'stats', None)
+        if stats is not None:
+            stats[key].add(duration, size)
+        with self.lock:
+            self.run_stats[key].add(duration, size)
+
+    def wrap_driver(self, driver):
+        """Trace the commands sent by a WebDriver."""
+        executor = driver.command_executor
+        execute = executor.execute
+
+        def traced_execute(command, params):
+            method = self.caller_method()
+            start = time.perf_counter()
+            response = execute(command, params)
+            end = time.perf_counter()
+            size = (len(json.dumps(params, default=str))
+                    + len(json.dumps(response, default=str)))
+            self.record(method, command, end - start, size)
+            self.add_event(command, 'webdriver', start, end, bytes=size)
+            return response
+
+        executor.execute = traced_execute
+
+    @contextmanager
+    def span(self, kind):
+        """Record the duration of a block of code, such as a wait."""
+        method = self.caller_method()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.record(method, kind, end - start)
+            self.add_event(kind, kind, start, end)
+
+    @contextmanager
+    def book(self, book_id):
+        """Collect separate statistics for processing a book."""
+        self.local.stats = defaultdict(Stats)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            duration = end - start
+            self.add_event(f'book {book_id}', 'book', start, end)
+            stats, self.local.stats = self.local.stats, None
+            with self.lock:
+                self.book_stats[book_id] = {
+                    'duration': round(duration, 3),
+                    'methods': self.method_summary(stats),
+                }
+            logger.debug("Book %s took %.1fs, %d WebDriver commands",
+                         book_id, duration, sum(
+                             len(s.durations) for (_, kind), s in stats.items()
+                             if kind != 'wait'))
+
+    @staticmethod
+    def method_summary(stats):
+        """Summarize statistics by method, with a breakdown by kind."""
+        methods = {}
+        for (method, kind), kind_stats in sorted(stats.items()):
+            info = methods.setdefault(method, {'commands': Stats(),
+                                               'kinds': {}})
+            if kind != 'wait':
+                info['commands'].merge(kind_stats)
+            info['kinds'][kind] = kind_stats.summary()
+        return {method: {**info['commands'].summary(), 'kinds': info['kinds']}
+                for method, info in methods.items()}
+
+    def report(self, path=None):
+        """Log the run summary, and optionally write all statistics to file."""
+        with self.lock:
+            methods = self.method_summary(self.run_stats)
+        logger.info("%-32s %7s %9s %8s %8s %8s", 'Method', 'Count', 'Total',
+                    'p50', 'p95', 'Wait')
+        for method, info in sorted(methods.items(),
+                                   key=lambda item: -item[1]['total']):
+            wait = info['kinds'].get('wait', {}).get('total', 0)
+            logger.info("%-32s %7d %8.1fs %7.3fs %7.3fs %7.1fs",
+                        method, info['count'], info['total'], info['p50'],
+                        info['p95'], wait)
+        if path:
+            with open(path, 'w') as f:
+                json.dump({'run': methods, 'books': self.book_stats}, f,
+                          indent=2)
+            logger.info("Saved trace statistics to %r", path)
+
+    def write_trace(self, path):
+        """Write the trace events to a file in Chrome Trace Event format."""
+        with self.lock:
+            events = list(self.events)
+        # Name threads after workers, in order of their first event
+        tids = {}
+        for event in events:
+            tids.setdefault(event['tid'], len(tids))
+        for event in events:
+            event['tid'] = tids[event['tid']]
+        events.extend({'name': 'thread_name', 'ph': 'M', 'pid': 1,
+                       'tid': tid, 'args': {'name': f'worker-{tid}'}}
+                      for tid in tids.values())
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        logger.info("Saved %d trace events to %r", len(events), path)
@@ -4,14 +4,22 @@ import json
 import logging
 import os.path
 import re
-from urllib.parse import urlparse
+import time
+from textwrap import dedent
+from urllib.parse import urljoin, urlparse
 
+from bs4 import BeautifulSoup
 from selenium.webdriver.common.action_chains import ActionChains
 
 from _common import (
+    DRIVERS,
+    Journal,
     LibraryThingRobot,
     add_common_flags,
+    add_session_cookies,
     get_class_list,
+    get_path,
+    http_session,
     init_logging,
     main_loop,
     parse_book_ids,
@@ -24,9 +32,25 @@ logger = logging.getLogger('ltje')
 class LibraryThingScraper(LibraryThingRobot):
     """Class to scrape book data from LibraryThing."""
 
-    def __init__(self, config, driver, extra):
+    def __init__(self, config, driver, extra, journal):
         super(LibraryThingScraper, self).__init__(config, driver)
         self.extra = extra
+        self.journal = journal
+
+    def parse_secondary_author(self, texts):
+        """Parse a secondary author from the text of the role/name spans."""
+        if len(texts) == 1:
+            name, = texts
+            logger.debug("Found secondary author %r with blank role", name)
+            return {'lf': name}
+        elif len(texts) == 2:
+            role, name = texts
+            # Trim ' -' after role name
+            role = role[:-2]
+            logger.debug("Found secondary author %r with role %r", name, role)
+            return {'lf': name, 'role': role}
+        else:
+            raise RuntimeError("Unable to parse secondary author")
 
     def get_secondary_authors(self):
         """Get list of secondary author names in order."""
@@ -34,19 +58,8 @@ class LibraryThingScraper(LibraryThingRobot):
         for elt in self.driver.find_elements_by_css_selector(
                 '#bookedit_roles > div.bookeditPerson'):
             spans = elt.find_elements_by_css_selector(':scope > span')
-            if len(spans) == 1:
-                name = spans[0].text
-                logger.debug("Found secondary author %r with blank role", name)
-                sa.append({'lf': name})
-            elif len(spans) == 2:
-                name = spans[1].text
-                # Trim ' -' after role name
-                role = spans[0].text[:-2]
-                logger.debug("Found secondary author %r with role %r",
-                             name, role)
-                sa.append({'lf': name, 'role': role})
-            else:
-                raise RuntimeError("Unable to parse secondary author")
+            sa.append(self.parse_secondary_author(
+                [span.text for span in spans]))
         return sa
 
     def get_languages(self):
@@ -114,13 +127,18 @@ class LibraryThingScraper(LibraryThingRobot):
             logger.debug("'From where' field not found")
             return None
         name = div.text
+        anchor = (try_find(div.find_element_by_css_selector, '.xlocation > a')
+                  if name else None)
+        return self.parse_from_where(
+            name, anchor.get_attribute('href') if anchor else None)
+
+    def parse_from_where(self, name, href):
+        """Parse book venue information from the venue name and link."""
         if not name:
             return {'name': ''}
-        anchor = try_find(div.find_element_by_css_selector, '.xlocation > a')
-        if anchor:
+        if href:
             # Parse venue link
-            href = urlparse(anchor.get_attribute('href'))
-            venue_id = self.venue_path_re.match(href.path).group(1)
+            venue_id = self.venue_path_re.match(urlparse(href).path).group(1)
             logger.debug("Found 'From where' field %r, venue id %r",
                          name, venue_id)
             return {'name': name, 'venue_id': venue_id}
@@ -129,8 +147,10 @@ class LibraryThingScraper(LibraryThingRobot):
             logger.debug("Found 'From where' field %r, free text", name)
             return {'name': name}
 
-    def check_cover_confirmed(self, div, anchor):
+    def check_cover_confirmed(self):
         """Check whether the current book cover is user-confirmed."""
+        div = self.driver.find_element_by_id('maincover')
+        anchor = div.find_element_by_tag_name('a')
         # For some reason clicking on the anchor doesn't work; we have to click
         # on the image element
         icon = anchor.find_element_by_css_selector('img.icon')
@@ -158,28 +178,20 @@ class LibraryThingScraper(LibraryThingRobot):
 
     cover_onclick_re = re.compile(r"si_info\('([^']*)'\)")
 
+    def parse_cover(self, onclick):
+        """Parse cover data from the onclick attribute of the cover link."""
+        cover_id = self.cover_onclick_re.match(onclick).group(1)
+        logger.debug("Found cover id %r", cover_id)
+        return {'id': cover_id}
+
     def get_cover(self):
         """Get cover id."""
         div = self.driver.find_element_by_id('maincover')
         anchor = div.find_element_by_tag_name('a')
-        match = self.cover_onclick_re.match(anchor.get_attribute('onclick'))
-        cover_id = match.group(1)
-        logger.debug("Found cover id %r", cover_id)
-        cover_data = {'id': cover_id}
-        if self.config.login:
-            cover_data['confirmed'] = self.check_cover_confirmed(div, anchor)
-        return cover_data
-
-    def process_book(self, book_id, book_data):
-        """Extract extra information about a book."""
-        logger.info("Processing book %s: %s", book_id, book_data['title'])
-        work_id = book_data.get('workcode', '')
-        url = f'https://www.librarything.com/work/{work_id}/details/{book_id}'
-        self.driver.get(url)
-        if self.driver.current_url != url:
-            logger.warning("Failed to get details for book %s", book_id)
-            return
+        return self.parse_cover(anchor.get_attribute('onclick'))
 
+    def scrape_elements(self):
+        """Extract book details by inspecting individual page elements."""
         extra = {}
         # Get secondary authors in correct order
         extra['secondary_authors'] = self.get_secondary_authors()
@@ -199,36 +211,462 @@ class LibraryThingScraper(LibraryThingRobot):
         extra['from_where'] = self.get_from_where()
         # Get cover details, not present in native export
         extra['cover'] = self.get_cover()
+        return extra
+
+    # Script to collect the raw contents of all relevant page elements at once.
+    # Text of hidden elements is reported as empty, like WebElement.text.
+    snapshot_script = dedent("""\
+        const visible = e => !!(e.offsetWidth || e.offsetHeight
+                                || e.getClientRects().length);
+        const text = e => visible(e) ? e.innerText.trim() : '';
+        const byId = id => document.getElementById(id);
+        const summary = byId('bookedit_summary');
+        const cover = document.querySelector('#maincover a');
+        if (!summary || !cover) {
+            return null;
+        }
+        const languages = {};
+        for (const eid of ['lang', 'lang2', 'lang_original']) {
+            const elt = byId(`bookedit_${eid}`);
+            if (!elt) {
+                return null;
+            }
+            languages[eid] = visible(elt) ? {
+                name: text(elt),
+                code: byId(`bookedit_${eid}-data`).innerText,
+            } : null;
+        }
+        const dates = byId('startedfinished');
+        const lexile = byId('bookedit_lexile');
+        const dewey = byId('bookedit_dewey');
+        const location = document.querySelector('.xlocation');
+        const venue = location && location.querySelector('.xlocation > a');
+        return {
+            roles: Array.from(
+                document.querySelectorAll(
+                    '#bookedit_roles > div.bookeditPerson'),
+                div => Array.from(div.querySelectorAll(':scope > span'),
+                                  text)),
+            languages: languages,
+            readingDates: dates && Array.from(
+                dates.querySelectorAll('tr[id^="xSF"]'),
+                row => Array.from(row.querySelectorAll('td'), text)),
+            lexile: lexile && text(lexile),
+            dewey: dewey && visible(dewey) ? text(dewey) : null,
+            summaryClasses: Array.from(summary.classList),
+            location: location && {
+                name: text(location),
+                href: venue && venue.href,
+            },
+            coverOnclick: cover.getAttribute('onclick'),
+        };""")
+
+    def parse_snapshot(self, snapshot):
+        """Extract book details from the result of the snapshot script."""
+        extra = {}
+        extra['secondary_authors'] = [
+            self.parse_secondary_author(texts) for texts in snapshot['roles']]
+        langs = {}
+        for key, eid in (('primary', 'lang'),
+                         ('secondary', 'lang2'),
+                         ('original', 'lang_original')):
+            lang_data = snapshot['languages'][eid]
+            if lang_data:
+                langs[key] = lang_data
+                logger.debug("Found %s language %r (%s)",
+                             key, lang_data['name'], lang_data['code'])
+        extra['languages'] = langs
+        dates = []
+        for started, finished in snapshot['readingDates'] or ():
+            logger.debug("Found reading dates: %r, %r", started, finished)
+            dates.append({'started': started, 'finished': finished})
+        extra['reading_dates'] = dates
+        extra['lexile'] = snapshot['lexile']
+        extra['dewey'] = snapshot['dewey']
+        logger.debug("Found Lexile value: %r, Dewey value: %r",
+                     extra['lexile'], extra['dewey'])
+        autogen = 'autogeneratedText' in snapshot['summaryClasses']
+        logger.debug("Found summary autogenerated: %r", autogen)
+        extra['summary_autogenerated'] = autogen
+        location = snapshot['location']
+        if location:
+            extra['from_where'] = self.parse_from_where(
+                location['name'], location['href'])
+        else:
+            logger.debug("'From where' field not found")
+            extra['from_where'] = None
+        extra['cover'] = self.parse_cover(snapshot['coverOnclick'])
+        return extra
+
+    def scrape_snapshot(self):
+        """Extract book details using a single script call."""
+        snapshot = self.driver.execute_script(self.snapshot_script)
+        if snapshot is None:
+            logger.warning("Page snapshot failed, inspecting page elements")
+            return self.scrape_elements()
+        extra = self.parse_snapshot(snapshot)
+        if self.config.scrape == 'verify':
+            expected = self.scrape_elements()
+            for key, value in expected.items():
+                if extra[key] != value:
+                    logger.warning("Snapshot value for %r is %r, expected %r",
+                                   key, extra[key], value)
+            return expected
+        return extra
+
+    def scrape_details(self, book_id, book_data):
+        """Extract extra information from the book details page."""
+        work_id = book_data.get('workcode', '')
+        url = self.url(f'/work/{work_id}/details/{book_id}')
+        self.navigate(url)
+        if self.driver.current_url != url:
+            logger.warning("Failed to get details for book %s", book_id)
+            return None
+
+        if self.config.scrape == 'elements':
+            extra = self.scrape_elements()
+        else:
+            extra = self.scrape_snapshot()
+        if self.config.no_covers:
+            extra['cover'] = None
+        # Cover confirmation status is only visible in the cover info
+        # lightbox, for logged-in users
+        elif self.config.login:
+            extra['cover']['confirmed'] = self.check_cover_confirmed()
+        return extra
+
+    # Map of book ids to field values found in the catalog
+    catalog = {}
+
+    # Map from catalog column headings to field names
+    catalog_columns = {
+        'languages': 'languages',
+        'language': 'languages',
+        'original language': 'original_language',
+        'lexile': 'lexile',
+        'date started': 'date_started',
+        'date read': 'date_read',
+        'from where': 'from_where',
+    }
+
+    catrow_id_re = re.compile('catrow_([0-9]+)')
+    next_page_re = re.compile(r'^\s*next\b', re.IGNORECASE)
+
+    def fetch_html(self, url):
+        """Load a page and return its source and final URL."""
+        self.navigate(url)
+        return self.driver.page_source, self.driver.current_url
+
+    def parse_catalog_columns(self, row):
+        """Get the field name of each catalog column, or None if unknown."""
+        header = row.find_parent('table').find('tr')
+        if header is row:
+            raise RuntimeError("Unable to find catalog column headings")
+        return [self.catalog_columns.get(cell.get_text().strip().casefold())
+                for cell in header.find_all(('th', 'td'), recursive=False)]
+
+    def find_next_page_link(self, soup):
+        """Find the "next page" link of a catalog page, or None.
+
+        Links in the catalog rows are ignored, since book titles may also
+        start with "next".
+        """
+        for link in soup.find_all('a', string=self.next_page_re):
+            if not link.find_parent('tr', id=self.catrow_id_re):
+                return link
+        return None
 
+    def scrape_catalog(self, url):
+        """Collect book details from the pages of the user's catalog.
+
+        The catalog should be displayed with a style that includes the
+        columns listed in ``catalog_columns``. Pages are followed using the
+        "next page" link.
+        """
+        url = urljoin(self.url('/'), url)
+        while url:
+            logger.debug("Parsing catalog page %r", url)
+            html, base_url = self.fetch_html(url)
+            soup = BeautifulSoup(html, 'html.parser')
+            rows = soup.select('tr[id^="catrow_"]')
+            if not rows:
+                break
+            columns = self.parse_catalog_columns(rows[0])
+            for row in rows:
+                book_id = self.catrow_id_re.match(row['id']).group(1)
+                cells = row.find_all('td', recursive=False)
+                values = {}
+                for field, cell in zip(columns, cells):
+                    if not field:
+                        continue
+                    lines = [line.strip() for line in
+                             cell.get_text('\n').split('\n') if line.strip()]
+                    venue = cell.select_one('a[href*="/venue/"]')
+                    href = urljoin(base_url, venue['href']) if venue else None
+                    values[field] = lines, href
+                self.catalog[book_id] = values
+            next_link = self.find_next_page_link(soup)
+            url = urljoin(base_url, next_link['href']) if next_link else None
+        logger.info("Found %d books in catalog", len(self.catalog))
+
+    def get_catalog_languages(self, values, book_data):
+        """Get primary/secondary/original languages from catalog values."""
+        # Language codes are taken from the native export
+        codes = dict(zip(book_data.get('originallanguage', ()),
+                         book_data.get('originallanguage_codeA', ())))
+        codes.update(zip(book_data.get('language', ()),
+                         book_data.get('language_codeA', ())))
+        names, _ = values['languages']
+        if book_data.get('originallanguage'):
+            onames, _ = values['original_language']
+        else:
+            onames = []
+        langs = {}
+        for key, name in (*zip(('primary', 'secondary'), names),
+                          *zip(('original',), onames)):
+            if name not in codes:
+                raise KeyError(name)
+            langs[key] = {'name': name, 'code': codes[name]}
+        return langs
+
+    def complete_from_catalog(self, book_id, book_data):
+        """Get extra information from the catalog, or None if incomplete."""
+        values = self.catalog.get(book_id)
+        if values is None:
+            return None
+        # Fields only available on the details page. The order of secondary
+        # authors only matters if there is more than one. The catalog doesn't
+        # show whether a Dewey number was set by the user or autogenerated.
+        authors = book_data.get('authors') or []
+        if (len(authors) > 2 or book_data.get('summary')
+                or get_path(book_data, 'ddc', 'code')
+                or not self.config.no_covers):
+            return None
+        extra = {}
+        try:
+            extra['secondary_authors'] = [
+                {'lf': a['lf'], 'role': a['role']} if a.get('role')
+                else {'lf': a['lf']} for a in authors[1:]]
+            extra['languages'] = self.get_catalog_languages(values, book_data)
+            started, _ = values['date_started']
+            finished, _ = values['date_read']
+            lexile, _ = values['lexile']
+            lines, href = values['from_where']
+        except KeyError:
+            return None
+        # Blank dates are not shown, so dates can only be paired up if every
+        # reading has both
+        if len(started) != len(finished):
+            return None
+        extra['reading_dates'] = [{'started': s, 'finished': f}
+                                  for s, f in zip(started, finished)]
+        extra['lexile'] = lexile[0] if lexile else None
+        extra['dewey'] = None
+        extra['summary_autogenerated'] = None
+        extra['from_where'] = self.parse_from_where(' '.join(lines), href)
+        extra['cover'] = None
+        logger.debug("Found book details in catalog: %r", extra)
+        return extra
+
+    def process_book(self, book_id, book_data):
+        """Extract extra information about a book."""
+        logger.info("Processing book %s: %s", book_id, book_data['title'])
+        extra = self.complete_from_catalog(book_id, book_data)
+        if extra is None:
+            extra = self.scrape_details(book_id, book_data)
+        if extra is not None:
+            self.save_extra(book_id, extra)
+
+    def save_extra(self, book_id, extra):
+        """Record the extra information for a book."""
         extra_data = self.extra.setdefault(book_id, {})
         extra_data['_extra'] = extra
+        extra_data['_scraped'] = int(time.time())
+        # Save data immediately in case the script is interrupted
+        self.journal.append([book_id, extra_data])
+
+
+class LibraryThingHttpScraper(LibraryThingScraper):
+    """Class to scrape book data from LibraryThing without a browser.
+
+    Book details pages are fetched with an HTTP session and parsed into the
+    same format as the result of the snapshot script. Since stylesheets are
+    not evaluated, only inline styles are used to detect hidden elements.
+    """
+
+    def __init__(self, config, session, extra, journal):
+        super(LibraryThingHttpScraper, self).__init__(
+            config, None, extra, journal)
+        self.session = session
+
+    def fetch(self, url):
+        """Fetch a page."""
+        self.scheduler.acquire()
+        response = self.session.get(url, timeout=30)
+        response.raise_for_status()
+        return response
 
+    hidden_style_re = re.compile(r'display\s*:\s*none')
 
-def main(config, data, extra):
+    def is_visible(self, elt):
+        """Check whether an element and its ancestors are displayed."""
+        for e in (elt, *elt.parents):
+            if e.has_attr('hidden') or self.hidden_style_re.search(
+                    e.get('style', '')):
+                return False
+        return True
+
+    def get_text(self, elt):
+        """Get the text of an element, or '' if the element is hidden."""
+        return ' '.join(elt.get_text().split()) if self.is_visible(elt) else ''
+
+    def html_snapshot(self, soup, base_url):
+        """Collect the raw contents of the relevant elements of a page."""
+        summary = soup.find(id='bookedit_summary')
+        cover = soup.select_one('#maincover a')
+        if not summary or not cover:
+            return None
+        languages = {}
+        for eid in ('lang', 'lang2', 'lang_original'):
+            elt = soup.find(id=f'bookedit_{eid}')
+            if not elt:
+                return None
+            languages[eid] = {
+                'name': self.get_text(elt),
+                'code': soup.find(id=f'bookedit_{eid}-data').get_text(),
+            } if self.is_visible(elt) else None
+        dates = soup.find(id='startedfinished')
+        lexile = soup.find(id='bookedit_lexile')
+        dewey = soup.find(id='bookedit_dewey')
+        location = soup.select_one('.xlocation')
+        venue = location.select_one('.xlocation > a') if location else None
+        return {
+            'roles': [
+                [self.get_text(span)
+                 for span in div.select(':scope > span')]
+                for div in soup.select(
+                    '#bookedit_roles > div.bookeditPerson')],
+            'languages': languages,
+            'readingDates': [
+                [self.get_text(td) for td in row.find_all('td')]
+                for row in dates.select('tr[id^="xSF"]')
+            ] if dates else None,
+            'lexile': self.get_text(lexile) if lexile else None,
+            'dewey': (self.get_text(dewey)
+                      if dewey and self.is_visible(dewey) else None),
+            'summaryClasses': summary.get('class', []),
+            'location': {
+                'name': self.get_text(location),
+                'href': urljoin(base_url, venue['href']) if venue else None,
+            } if location else None,
+            'coverOnclick': cover.get('onclick'),
+        }
+
+    def fetch_html(self, url):
+        """Fetch a page and return its source and final URL."""
+        response = self.fetch(url)
+        return response.text, response.url
+
+    def scrape_details(self, book_id, book_data):
+        """Extract extra information from the book details page."""
+        work_id = book_data.get('workcode', '')
+        url = self.url(f'/work/{work_id}/details/{book_id}')
+        html, current_url = self.fetch_html(url)
+        if current_url != url:
+            logger.warning("Failed to get details for book %s", book_id)
+            return None
+        soup = BeautifulSoup(html, 'html.parser')
+        snapshot = self.html_snapshot(soup, current_url)
+        if snapshot is None:
+            raise RuntimeError("Unable to parse book details page")
+        extra = self.parse_snapshot(snapshot)
+        if self.config.no_covers:
+            extra['cover'] = None
+        return extra
+
+
+def main(config, data, extra, journal):
     """Import JSON data into LibraryThing."""
 
     def init_fn(driver):
-        ltrobot = LibraryThingScraper(config, driver, extra)
+        ltrobot = LibraryThingScraper(config, driver, extra, journal)
         if config.login:
             ltrobot.login()
         else:
-            driver.get('https://www.librarything.com')
+            ltrobot.navigate(ltrobot.url('/'))
             ltrobot.close_gdpr_banner()
+        init_catalog(ltrobot)
         return ltrobot
 
+    def init_http_fn(session):
+        if config.login:
+            if not LibraryThingRobot.shared_cookies:
+                # Log in with the browser once to obtain session cookies
+                with DRIVERS[config.browser]() as driver:
+                    LibraryThingRobot(config, driver).login()
+                logger.warning("Cover confirmation status is not available "
+                               "in HTTP mode")
+            add_session_cookies(session, LibraryThingRobot.shared_cookies)
+        ltrobot = LibraryThingHttpScraper(config, session, extra, journal)
+        init_catalog(ltrobot)
+        return ltrobot
+
+    def init_catalog(ltrobot):
+        # Only done once, by the first worker
+        if config.catalog and not LibraryThingScraper.catalog:
+            ltrobot.scrape_catalog(config.catalog)
+
+    def skip_fn(book_id, book_data):
+        return config.update and is_up_to_date(config, extra.get(book_id))
+
+    if config.http:
+        return main_loop(config, data, 'process', init_http_fn,
+                         LibraryThingHttpScraper.process_book, skip_fn,
+                         http_session)
     return main_loop(config, data, 'process', init_fn,
-                     LibraryThingScraper.process_book)
+                     LibraryThingScraper.process_book, skip_fn)
+
+
+def is_up_to_date(config, extra_data):
+    """Check whether previously scraped book data can be reused."""
+    if not extra_data or '_extra' not in extra_data:
+        return False
+    if config.max_age is None:
+        return True
+    # Data without a timestamp is considered stale
+    scraped = extra_data.get('_scraped', 0)
+    return time.time() - scraped < config.max_age * 86400
 
 
 def init_extra_data(config, data):
     """Initialize extra data."""
-    # If --update is set and output file exists, read previous data
-    if config.update and os.path.exists(config.outfile):
-        with open(config.outfile) as f:
-            return json.load(f)
-    # Otherwise create an empty dict for extra data
-    else:
-        return {}
+    extra = {}
+    if config.update:
+        # If --update is set and output file exists, read previous data
+        if os.path.exists(config.outfile):
+            with open(config.outfile) as f:
+                extra = json.load(f)
+        # Recover data from an interrupted run
+        if os.path.exists(config.journal_file):
+            logger.info("Recovering data from journal %r",
+                        config.journal_file)
+            for book_id, extra_data in Journal.replay(config.journal_file):
+                extra[book_id] = extra_data
+    elif os.path.exists(config.journal_file):
+        logger.warning("Discarding journal %r from a previous run",
+                       config.journal_file)
+    return extra
+
+
+def compact_journal(config, extra):
+    """Write the collected data to the output file and remove the journal."""
+    tmp_file = f'{config.outfile}.tmp'
+    with open(tmp_file, 'w') as f:
+        # Pretty-print
+        json.dump(extra, f, indent=2)
+        f.write('\n')
+    os.replace(tmp_file, config.outfile)
+    os.remove(config.journal_file)
 
 
 if __name__ == '__main__':
@@ -237,20 +675,48 @@ if __name__ == '__main__':
     parser.add_argument('-l', '--login', action='store_true',
                         help="Log in to LibraryThing to allow access to "
                         "private book information.")
+    parser.add_argument('--scrape', choices=('script', 'elements', 'verify'),
+                        default='script', help="How to read book details: "
+                        "'script', in a single script call; 'elements', by "
+                        "inspecting each page element; 'verify', using both "
+                        "methods and logging any differences")
+    parser.add_argument('--http', action='store_true',
+                        help="Fetch book details pages with HTTP requests "
+                        "instead of the browser. Use with --workers and a "
+                        "higher --rate to make several requests in parallel.")
+    parser.add_argument('--catalog', metavar='URL',
+                        help="Collect book details from the catalog pages "
+                        "starting at the given URL, and only visit book "
+                        "details pages for information not in the catalog. "
+                        "Details pages are still loaded for every book "
+                        "unless --no-covers is set")
+    parser.add_argument('--no-covers', action='store_true',
+                        help="Don't collect book cover details")
     parser.add_argument('-u', '--update', action='store_true',
-                        help="Update output file instead of replacing")
+                        help="Update output file instead of replacing. Books "
+                        "already present in the output file are skipped.")
+    parser.add_argument('--max-age', type=float, metavar='DAYS',
+                        help="With --update, re-process books scraped more "
+                        "than the given number of days ago")
     parser.add_argument('infile', help="Input file containing JSON book data.")
     parser.add_argument('outfile', help="Output file to write data")
     config = parser.parse_args()
+    config.journal_file = f'{config.outfile}.journal'
     init_logging(config, 'ltje')
     parse_book_ids(config)
     with open(config.infile) as f:
         data = json.load(f)
     extra = init_extra_data(config, data)
-    success = main(config, data, extra)
-    if success:
-        with open(config.outfile, 'w') as f:
-            # Pretty-print
-            json.dump(extra, f, indent=2)
-            f.write('\n')
+    # Records are appended to the journal as they are scraped, then compacted
+    # into the output file at exit
+    with Journal(config.journal_file, resume=config.update) as journal:
+        success = main(config, data, extra, journal)
+    # Without --update, a failed run would replace the output file with
+    # partial data
+    if success or config.update:
+        compact_journal(config, extra)
+    else:
+        logger.warning("Not writing %r after errors; data is kept in %r, "
+                       "re-run with --update to resume", config.outfile,
+                       config.journal_file)
     exit(0 if success else 1)
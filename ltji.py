@@ -3,11 +3,16 @@ import argparse
 import json
 import logging
 import math
+import os.path
 import re
+import threading
 import time
+from collections import Counter
+from contextlib import nullcontext
 from textwrap import dedent
-from urllib.parse import parse_qs, urlparse
+from urllib.parse import parse_qs, urljoin, urlparse
 
+from bs4 import BeautifulSoup
 from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
@@ -15,19 +20,23 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import Select
 
 from _common import (
+    Journal,
     LibraryThingRobot,
+    LookupCache,
     add_common_flags,
+    add_session_cookies,
     defocus,
     get_class_list,
-    get_inline_styles,
     get_parent,
     get_path,
+    http_session,
     init_logging,
     main_loop,
     normalize_newlines,
     page_loaded_condition,
     parse_book_ids,
     parse_list,
+    positive_int,
     try_find,
 )
 
@@ -55,8 +64,213 @@ def set_text_elt(elt, value, desc, *args):
             elt.send_keys('')
 
 
-def set_text(scope, elt_id, value):
-    """Set the value of a text element by id."""
+class FormSnapshot:
+    """State of the form fields on the current page.
+
+    The values of all input, select and textarea elements are read with a
+    single script call, so that fields which already have the desired value
+    can be skipped without inspecting each element. The snapshot is not
+    updated when fields are changed, so each field should only be checked
+    once.
+    """
+
+    script = dedent("""\
+        const visible = e => !!(e.offsetWidth || e.offsetHeight
+                                || e.getClientRects().length);
+        const ids = {};
+        const names = {};
+        for (const elt of document.querySelectorAll(
+                'input, select, textarea')) {
+            const state = {
+                value: elt.value,
+                autogen: elt.classList.contains('autogeneratedText'),
+                checked: elt.checked,
+                text: (elt.tagName === 'SELECT' && elt.selectedIndex >= 0
+                       ? elt.options[elt.selectedIndex].text : null),
+                visible: visible(elt),
+            };
+            if (elt.id && !(elt.id in ids)) {
+                ids[elt.id] = state;
+            }
+            if (elt.name) {
+                (names[elt.name] = names[elt.name] || []).push(state);
+            }
+        }
+        return {ids: ids, names: names};""")
+
+    def __init__(self, driver):
+        snapshot = driver.execute_script(self.script)
+        self.ids = snapshot['ids']
+        self.names = snapshot['names']
+
+    def has_text(self, elt_id, value):
+        """Check whether a text field is known to have the given value."""
+        state = self.ids.get(elt_id)
+        if state is None:
+            return False
+        if value:
+            return (state['value'] == normalize_newlines(value)
+                    and not state['autogen'])
+        return not state['value']
+
+    def has_value(self, elt_id, value):
+        """Check whether a select element is known to have the given value."""
+        state = self.ids.get(elt_id)
+        return state is not None and state['value'] == value
+
+    def has_selected_text(self, elt_id, text):
+        """Check whether a select element is known to show the given text."""
+        state = self.ids.get(elt_id)
+        return state is not None and state['text'] == text
+
+    def has_checked(self, elt_id, checked):
+        """Check whether a checkbox is known to have the given state."""
+        state = self.ids.get(elt_id)
+        return state is not None and state['checked'] == checked
+
+    def is_visible(self, elt_id):
+        """Get whether an element is displayed, or None if unknown."""
+        state = self.ids.get(elt_id)
+        return state['visible'] if state is not None else None
+
+    def get_values(self, name):
+        """Get the values of the elements with the given name."""
+        return [state['value'] for state in self.names.get(name, ())]
+
+
+class OptionIndex:
+    """Options of a select element, read with a single script call."""
+
+    script = dedent("""\
+        return Array.from(arguments[0].options,
+                          opt => [opt.value, opt.text, opt.textContent]);""")
+
+    def __init__(self, driver, select):
+        # List of (value, text, textContent) tuples
+        self.options = [tuple(opt) for opt in
+                        driver.execute_script(self.script, select._el)]
+        self.values = {value for value, _, _ in self.options}
+        # Form snapshot of the page the options were read from
+        self.form = None
+
+
+def normalize_isbn(value):
+    """Normalize an ISBN or EAN, converting ISBN-10 to ISBN-13."""
+    value = re.sub('[^0-9X]', '', str(value).upper())
+    if len(value) == 10:
+        value = f'978{value[:9]}'
+        total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(value))
+        value = f'{value}{-total % 10}'
+    return value
+
+
+class LibraryIndex:
+    """Index of the books in an existing library, from a JSON export.
+
+    Books are matched by ISBN/EAN if the new book has one, and otherwise by
+    title and primary author. Barcodes of different libraries can collide, so
+    a barcode match also needs the same title and primary author. Book ids
+    from the import data are matched in the same way against existing
+    barcodes and numeric tags, in case they were used to record the original
+    book id.
+    """
+
+    def __init__(self, existing):
+        self.keys = {}
+        self.titles = {}
+        for existing_id, book_data in existing.items():
+            self.titles[existing_id] = self.title_key(book_data)
+            for barcode in self.barcodes(book_data):
+                self.add_key(('barcode', barcode), existing_id)
+                self.add_key(('books_id', barcode), existing_id)
+            for isbn in self.isbns(book_data):
+                self.add_key(('isbn', isbn), existing_id)
+            for tag in book_data.get('tags') or ():
+                if tag.isdigit():
+                    self.add_key(('books_id', tag), existing_id)
+            if self.titles[existing_id]:
+                self.add_key(('title', self.titles[existing_id]), existing_id)
+
+    def add_key(self, key, existing_id):
+        """Add an index key of an existing book."""
+        ids = self.keys.setdefault(key, [])
+        if existing_id not in ids:
+            ids.append(existing_id)
+
+    @staticmethod
+    def barcodes(book_data):
+        """Get the barcodes of a book."""
+        return [barcode for barcode in
+                (book_data.get('barcode') or {}).values() if barcode]
+
+    @staticmethod
+    def isbns(book_data):
+        """Get the normalized ISBNs and EANs of a book."""
+        isbns = book_data.get('isbn') or ()
+        if isinstance(isbns, dict):
+            isbns = isbns.values()
+        elif isinstance(isbns, str):
+            isbns = [isbns]
+        return [normalize_isbn(value) for value in
+                (book_data.get('originalisbn'), *isbns,
+                 *(book_data.get('ean') or ())) if value]
+
+    @staticmethod
+    def title_key(book_data):
+        """Get the title and primary author of a book, or None."""
+        title = book_data.get('title')
+        if not title:
+            return None
+        return (title.casefold(),
+                (book_data.get('primaryauthor') or '').casefold())
+
+    def find(self, book_id, book_data):
+        """Find an existing book matching the given book."""
+        title_key = self.title_key(book_data)
+        barcodes = self.barcodes(book_data)
+        for key in (('books_id', book_id),
+                    *(('barcode', barcode) for barcode in barcodes)):
+            for existing_id in self.keys.get(key, ()):
+                if title_key and self.titles[existing_id] == title_key:
+                    return existing_id, key[0]
+        isbns = self.isbns(book_data)
+        for isbn in isbns:
+            existing_ids = self.keys.get(('isbn', isbn))
+            if existing_ids:
+                return existing_ids[0], 'isbn'
+        if title_key and not isbns and not barcodes:
+            existing_ids = self.keys.get(('title', title_key))
+            if existing_ids:
+                return existing_ids[0], 'title'
+        return None, None
+
+
+def form_value(elt):
+    """Get the value a browser would submit for a form control, or None."""
+    if elt.name == 'textarea':
+        return elt.get_text()
+    if elt.name == 'select':
+        option = (elt.find('option', selected=True)
+                  or elt.find('option'))
+        if option is None:
+            return None
+        return option.get('value', option.get_text())
+    input_type = elt.get('type', 'text').lower()
+    if input_type in ('checkbox', 'radio'):
+        return elt.get('value', 'on') if elt.has_attr('checked') else None
+    if input_type in ('submit', 'button', 'image', 'reset', 'file'):
+        return None
+    return elt.get('value', '')
+
+
+def set_text(scope, elt_id, value, form=None):
+    """Set the value of a text element by id.
+
+    Returns the element, or None if the form snapshot shows that the value
+    was already set.
+    """
+    if form and form.has_text(elt_id, value):
+        return None
     elt = scope.find_element_by_id(elt_id)
     set_text_elt(elt, value, "text field %r", elt_id)
     return elt
@@ -69,8 +283,10 @@ def select_by_value(select, value, log_msg, *log_args):
         select.select_by_value(value)
 
 
-def set_select(scope, elt_id, value, name=None):
+def set_select(scope, elt_id, value, name=None, form=None):
     """Set the value of a select element by id."""
+    if form and form.has_value(elt_id, value):
+        return None
     select = Select(scope.find_element_by_id(elt_id))
     if name:
         select_by_value(select, value,
@@ -81,8 +297,10 @@ def set_select(scope, elt_id, value, name=None):
     return select
 
 
-def set_checkbox(scope, elt_id, selected):
+def set_checkbox(scope, elt_id, selected, form=None):
     """Set the value of a checkbox element."""
+    if form and form.has_checked(elt_id, selected):
+        return None
     checkbox = scope.find_element_by_id(elt_id)
     if checkbox.is_selected() != selected:
         logger.debug("%s checkbox %r",
@@ -94,15 +312,162 @@ def set_checkbox(scope, elt_id, selected):
 class LibraryThingImporter(LibraryThingRobot):
     """Class to add books to LibraryThing."""
 
+    def __init__(self, config, driver, progress, ledger=None):
+        super(LibraryThingImporter, self).__init__(config, driver)
+        # Cache of select option indexes, by page type and select key
+        self.option_indexes = {}
+        self.page_type = None
+        # Map of book ids to import progress records, and optional journal
+        # in which to record progress
+        self.progress = progress
+        self.ledger = ledger
+
+    def record_progress(self, book_id, step, /, **info):
+        """Record that a step of importing a book has completed.
+
+        Steps are 'created' (the book exists, but hasn't been edited),
+        'saved' (book fields have been saved) and 'done' (cover set). The
+        info usually includes the LibraryThing ``book_id`` of the new book,
+        which is distinct from the ``book_id`` of the import data.
+        """
+        record = self.progress[book_id] = {'step': step, **info}
+        if self.ledger:
+            self.ledger.append([book_id, record])
+
+    # Lookup tables discovered from the website, shared across workers and
+    # persisted between runs
+    lookup_tables = ('langs', 'custom_formats', 'venues', 'featured_sources',
+                     'all_sources', 'blank_covers')
+    cache = LookupCache()
+    # Names of tables loaded from the cache and not yet re-parsed this run
+    cached_tables = set()
+
+    @classmethod
+    def load_cache(cls, cache):
+        """Populate lookup tables from a persistent cache."""
+        cls.cache = cache
+        for table in cls.lookup_tables:
+            data = cache.get(table)
+            if data:
+                logger.debug("Loaded table %r from cache", table)
+                getattr(cls, table).update(data)
+                cls.cached_tables.add(table)
+
+    def save_table(self, table):
+        """Save a lookup table to the persistent cache."""
+        data = getattr(self, table)
+        self.cache.put(table, sorted(data) if isinstance(data, set)
+                       else dict(data))
+
+    def is_stale(self, table):
+        """Check whether a table loaded from the cache should be re-parsed.
+
+        Each cached table is re-parsed at most once per run.
+        """
+        if table not in self.cached_tables:
+            return False
+        logger.debug("Cached table %r may be out of date", table)
+        self.cached_tables.discard(table)
+        getattr(self, table).clear()
+        return True
+
+    # Snapshot of the add/edit book form, read before setting fields
+    form = None
+    # Map of field ids to (kind, value) pairs waiting to be written, or None
+    # if fields should be set immediately
+    pending_fields = None
+
+    def set_plain_field(self, kind, elt_id, value):
+        """Set a simple text, select or checkbox field by id."""
+        if self.pending_fields is not None:
+            self.pending_fields[elt_id] = kind, value
+        elif kind == 'text':
+            set_text(self.driver, elt_id, value, self.form)
+        elif kind == 'select':
+            set_select(self.driver, elt_id, value, form=self.form)
+        elif kind == 'checkbox':
+            set_checkbox(self.driver, elt_id, value, self.form)
+        else:
+            raise ValueError(f"Invalid field kind: {kind!r}")
+
+    write_fields_script = dedent("""\
+        const fields = arguments[0];
+        const fire = (elt, type) => elt.dispatchEvent(
+            new Event(type, {bubbles: type !== 'focus' && type !== 'blur'}));
+        for (const [id, kind, value] of fields) {
+            const elt = document.getElementById(id);
+            if (!elt) {
+                continue;
+            }
+            if (kind === 'checkbox') {
+                if (elt.checked !== value) {
+                    elt.click();
+                }
+                continue;
+            }
+            fire(elt, 'focus');
+            elt.value = value;
+            fire(elt, 'input');
+            fire(elt, 'change');
+            fire(elt, 'blur');
+        }
+        // Return the ids of fields that don't have the expected value
+        return fields.filter(([id, kind, value]) => {
+            const elt = document.getElementById(id);
+            return !elt || (kind === 'checkbox' ? elt.checked : elt.value)
+                !== value;
+        }).map(([id]) => id);""")
+
+    def write_fields(self):
+        """Write all pending field values with a single script call."""
+        fields, self.pending_fields = self.pending_fields, None
+        batch = []
+        for elt_id, (kind, value) in fields.items():
+            if kind == 'text':
+                value = normalize_newlines(value) or ''
+                if self.form.has_text(elt_id, value):
+                    continue
+                state = self.form.ids.get(elt_id)
+                # Type into autogenerated fields to clear the autogenerated
+                # state, and let missing fields raise an exception
+                if state is None or state['autogen']:
+                    self.set_plain_field(kind, elt_id, value)
+                    continue
+            elif kind == 'select' and self.form.has_value(elt_id, value):
+                continue
+            elif kind == 'checkbox' and self.form.has_checked(elt_id, value):
+                continue
+            batch.append([elt_id, kind, value])
+        if not batch:
+            return
+        logger.debug("Setting fields %s",
+                     ', '.join(repr(elt_id) for elt_id, _, _ in batch))
+        failed = self.driver.execute_script(self.write_fields_script, batch)
+        for elt_id in failed:
+            logger.debug("Failed to set field %r with script, retrying",
+                         elt_id)
+            kind, value = fields[elt_id]
+            self.set_plain_field(kind, elt_id, value)
+
     def set_author_role(self, scope, elt_id, text):
         """Set author role with the given element id."""
+        if self.form and (self.form.has_selected_text(elt_id, text) if text
+                          else self.form.has_value(elt_id, '')):
+            return
         select = Select(scope.find_element_by_id(elt_id))
         if not text:
             select_by_value(select, '', "Clearing author role %r", elt_id)
             return
         if select.first_selected_option.text == text:
             return  # Already selected
-        available = {option.text for option in select.options[2:-2]}
+        options = self.get_option_index('role', select).options
+        available = {opt_text for _, opt_text, _ in options[2:-2]}
+        if text not in available:
+            # The role may have been added by another session
+            index = self.reload_option_index('role', select)
+            if index:
+                available = {opt_text for _, opt_text, _
+                             in index.options[2:-2]}
         if text in available:
             logger.debug("Setting author role %r to %r", elt_id, text)
             select.select_by_visible_text(text)
@@ -114,11 +479,46 @@ class LibraryThingImporter(LibraryThingRobot):
             alert = self.wait_until(EC.alert_is_present())
             alert.send_keys(text)
             alert.accept()
+            self.invalidate_option_index('role')
+
+    def get_option_index(self, key, select):
+        """Get the options of a select element, cached by page type."""
+        cache_key = self.page_type, key
+        index = self.option_indexes.get(cache_key)
+        if index is None:
+            logger.debug("Reading options of %r select", key)
+            index = self.option_indexes[cache_key] = OptionIndex(
+                self.driver, select)
+            index.form = self.form
+        return index
+
+    def reload_option_index(self, key, select):
+        """Re-read the options of a select element if they may be outdated.
+
+        Other sessions may have added options, such as custom media types,
+        since the cached options were read. Returns the new options, or None
+        if the options were already read for the current form.
+        """
+        cache_key = self.page_type, key
+        index = self.option_indexes.get(cache_key)
+        if index is not None and index.form is self.form:
+            return None
+        logger.debug("Re-reading options of %r select", key)
+        index = self.option_indexes[cache_key] = OptionIndex(
+            self.driver, select)
+        index.form = self.form
+        return index
+
+    def invalidate_option_index(self, key):
+        """Remove the cached options of a select element for all pages."""
+        for cache_key in list(self.option_indexes):
+            if cache_key[1] == key:
+                del self.option_indexes[cache_key]
 
     def set_author(self, scope, name_id, role_id, author):
         """Set author with the given name/role element ids."""
         author = author or {}
-        set_text(scope, name_id, author.get('lf'))
+        set_text(scope, name_id, author.get('lf'), self.form)
         self.set_author_role(scope, role_id, author.get('role'))
 
     def set_other_authors(self, sauthors):
@@ -153,8 +553,9 @@ class LibraryThingImporter(LibraryThingRobot):
         tags = tags or []
         if self.config.tag:
             tags.append(self.config.tag)
-        field = set_text(self.driver, 'form_tags', ", ".join(tags))
-        defocus(field)  # Defocus text field to avoid autocomplete popup
+        field = set_text(self.driver, 'form_tags', ", ".join(tags), self.form)
+        if field:
+            defocus(field)  # Defocus text field to avoid autocomplete popup
 
     def parse_collections(self, scope):
         """Parse the list of collection checkboxes."""
@@ -177,10 +578,8 @@ class LibraryThingImporter(LibraryThingRobot):
         sbpid = get_parent(show_button).get_attribute('id')
         assert sbpid.startswith('collsa_')
         cb_div = scope.find_element_by_id(sbpid[7:])
-        logger.debug("Clicking 'show all' collections button")
-        show_button.click()
-        self.wait_until(
-            lambda _: ('overflow', 'visible') in get_inline_styles(cb_div))
+        self.click_ajax(show_button, "Clicking 'show all' collections button")
+        self.wait_for_style(cb_div, 'overflow', 'visible')
 
     def add_collections(self, scope, to_add):
         """Create new collections."""
@@ -205,16 +604,61 @@ class LibraryThingImporter(LibraryThingRobot):
             elt.send_keys(cname)
         save_button = lb_content.find_element_by_css_selector(
             ':scope > div:nth-of-type(1) > .ltbtn')
-        logger.debug("Saving new collections")
-        save_button.click()
+        self.click_ajax(save_button, "Saving new collections")
         self.wait_until(EC.staleness_of(lb_content))
         self.wait_until(page_loaded_condition, 30)
+        # The page has been reloaded
+        self.form = FormSnapshot(self.driver)
         for cname in to_add:
             logger.info("Created collection %r", cname)
 
+    # Map of collection names to checkbox ids, shared across workers
+    collection_ids = {}
+
+    def parse_collection_ids(self, scope):
+        """Read the names and checkbox ids of all collections at once."""
+        cids = dict(self.driver.execute_script(dedent("""\
+            return Array.from(arguments[0].querySelectorAll('div.cb')).map(
+                div => [div.querySelector('span.lab').innerText,
+                        div.querySelector('input[type="checkbox"]').id]);
+            """), scope))
+        if all(cids.values()):
+            self.collection_ids.update(cids)
+
+    def prepare_collections(self, cnames):
+        """Create missing collections before importing books."""
+        if not cnames:
+            return
+        _, parent = self.driver.find_elements_by_id('bookedit_tags')
+        cbs = self.parse_collections(parent)
+        if not cnames <= cbs.keys():
+            self.show_all_collections(parent)
+            cbs = self.parse_collections(parent)
+        to_add = cnames - cbs.keys()
+        if to_add:
+            self.add_collections(parent, sorted(to_add))
+            _, parent = self.driver.find_elements_by_id('bookedit_tags')
+        self.parse_collection_ids(parent)
+
+    def prepare(self, cnames, formats, sources):
+        """Set up collections, media types and sources before importing."""
+        if cnames or formats:
+            self.navigate(self.url('/addnew.php'))
+            self.prepare_collections(cnames)
+            self.prepare_formats(formats)
+        if sources:
+            self.prepare_sources(sources)
+
     def set_collections(self, cnames):
         """Set collections."""
         cnames = set(cnames)
+        cids = self.collection_ids
+        if (self.pending_fields is not None and cnames <= cids.keys()
+                and all(self.form.ids.get(cid) for cid in cids.values())):
+            # Write all collection checkboxes with the other fields
+            for cname, cid in cids.items():
+                self.set_plain_field('checkbox', cid, cname in cnames)
+            return
         for _ in range(2):
             # Collections section has the same id as tags, perhaps due to a
             # copy-paste error in the website source
@@ -241,6 +685,8 @@ class LibraryThingImporter(LibraryThingRobot):
         """Set star rating."""
         star = math.ceil(rating) or 1  # Which star to click on
         target = str(int(rating * 2))
+        if self.form and self.form.has_value('form_rating', target):
+            return
         parent = self.driver.find_element_by_xpath(
             '//*[@id="form_rating"]/../..')
         # Click up to 3 times until rating reaches desired value
@@ -250,11 +696,9 @@ class LibraryThingImporter(LibraryThingRobot):
                 break
             star_elt = get_parent(rating_elt).find_element_by_css_selector(
                 f':scope > img:nth-of-type({star})')
-            logger.debug("Clicking rating star %d", star)
-            star_elt.click()
+            self.click_ajax(star_elt, "Clicking rating star %d", star)
             # Opacity is set to 0.3 while updating, then to 1 on success
-            self.wait_until(
-                lambda _: ('opacity', '1') in get_inline_styles(parent))
+            self.wait_for_style(parent, 'opacity', '1')
         else:
             rating_elt = parent.find_element_by_id('form_rating')
             if rating_elt.get_attribute('value') != target:
@@ -268,6 +712,7 @@ class LibraryThingImporter(LibraryThingRobot):
             return Array.from(arguments[0].querySelectorAll('option'))
                 .slice(3).map(opt => [opt.innerText, opt.value]);
         """), select._el))
+        self.save_table('langs')
 
     def set_review_language(self, lang):
         """Set review language."""
@@ -282,12 +727,13 @@ class LibraryThingImporter(LibraryThingRobot):
             if lang_elt.get_attribute('value') == self.langs[lang]:
                 return
         # Click button to change language
-        logger.debug("Clicking review language 'change' button")
-        parent_elt.find_element_by_css_selector('a').click()
+        self.click_ajax(parent_elt.find_element_by_css_selector('a'),
+                        "Clicking review language 'change' button")
         # Select language
         select = Select(self.wait_until(
             lambda _: parent_elt.find_element_by_css_selector('select')))
-        if not self.langs:
+        if not self.langs or (lang not in self.langs
+                              and self.is_stale('langs')):
             self.parse_review_langs(select)
         if lang in self.langs:
             value = self.langs[lang]
@@ -305,67 +751,121 @@ class LibraryThingImporter(LibraryThingRobot):
 
     custom_formats = {}  # Map from format code to select value
 
-    def select_format(self, select, format_data):
+    def select_format(self, select, key, format_data):
         """Select media type by code value."""
         format_code = format_data['code']
         value = self.custom_formats.get(format_code, format_code)
-        if value not in (opt.get_attribute('value') for opt in select.options):
+        index = self.get_option_index(key, select)
+        if value not in index.values and key == 'mediatype_all':
+            # The media type may have been added by another session
+            index = self.reload_option_index(key, select) or index
+        if value not in index.values:
+            if value != format_code and key == 'mediatype_all':
+                # Cached custom media type no longer exists
+                logger.debug("Dropping stale media type mapping %r -> %r",
+                             format_code, value)
+                self.custom_formats.pop(format_code, None)
+                self.save_table('custom_formats')
             return False
         select_by_value(select, value,
                         "Selecting media type %r (%s)",
                         format_data['text'], value)
         return True
 
-    def select_custom_format(self, select, format_data):
-        """Select custom media type by name and parent code."""
-        format_text = format_data['text']
-        format_code = format_data['code']
+    def find_custom_format(self, options, format_code, format_text):
+        """Find a custom media type by name and parent code.
+
+        Returns a tuple of the select value and parent option text, or None.
+        """
         indent = '\u2003' * format_code.count('.')
         format_text_indented = f'{indent}{format_text}'
-        pvalue, _ = format_code.rsplit('.', 1)
-        popt = None
-        for opt in select.options[5:]:
-            if not popt:  # First scan list for parent format
-                if opt.get_attribute('value') == pvalue:
-                    popt = opt
+        pcode, _ = format_code.rsplit('.', 1)
+        pvalue = self.custom_formats.get(pcode, pcode)
+        ptext = None
+        for value, text, opt_text in options[5:]:
+            if ptext is None:  # First scan list for parent format
+                if value == pvalue:
+                    ptext = text
             else:  # Then look for custom format under parent format
-                # Get text with whitespace since we need to check the indent
-                opt_text = opt.get_attribute("textContent")
+                # Use text with whitespace since we need to check the indent
                 if not opt_text.startswith(indent):
                     break
                 if opt_text == format_text_indented:
-                    value = opt.get_attribute('value')
-                    select_by_value(select, value,
-                                    "Selecting media type %r (%s), "
-                                    "nested under %r (%s)",
-                                    format_text, value, popt.text, pvalue)
-                    self.custom_formats[format_code] = value
-                    return True
-        return False
+                    return value, ptext
+        return None
+
+    def select_custom_format(self, select, key, format_data):
+        """Select custom media type by name and parent code."""
+        format_text = format_data['text']
+        format_code = format_data['code']
+        found = self.find_custom_format(
+            self.get_option_index(key, select).options, format_code,
+            format_text)
+        if not found:
+            # The media type may have been added by another session
+            index = self.reload_option_index(key, select)
+            if index:
+                found = self.find_custom_format(
+                    index.options, format_code, format_text)
+        if not found:
+            return False
+        value, ptext = found
+        select_by_value(select, value,
+                        "Selecting media type %r (%s), nested under %r",
+                        format_text, value, ptext)
+        self.custom_formats[format_code] = value
+        self.save_table('custom_formats')
+        return True
+
+    def prepare_formats(self, formats):
+        """Look up the select values of custom media types.
+
+        Custom media types which don't exist yet are created by the first
+        book that uses them, since they are only added when a book is saved.
+        """
+        formats = {code: text for code, text in formats.items()
+                   if code not in self.custom_formats}
+        if not formats:
+            return
+        options = OptionIndex(
+            self.driver,
+            Select(self.driver.find_element_by_id('mediatype_all'))).options
+        # Look up parent formats before their children
+        for code in sorted(formats, key=lambda code: code.count('.')):
+            found = self.find_custom_format(options, code, formats[code])
+            if found:
+                logger.debug("Found media type %r (%s) with value %r",
+                             formats[code], code, found[0])
+                self.custom_formats[code] = found[0]
+            else:
+                logger.debug("Media type %r (%s) not found",
+                             formats[code], code)
+        self.save_table('custom_formats')
 
     def set_format(self, format_data):
         """Set media type."""
         parent = self.driver.find_element_by_id('mediatypemenus')
         complete = 'showmediatypeall' in get_class_list(parent)
-        select = Select(parent.find_element_by_id(
-            'mediatype_all' if complete else 'mediatype'))
+        key = 'mediatype_all' if complete else 'mediatype'
+        select = Select(parent.find_element_by_id(key))
         if not format_data:
             select_by_value(select, '', "Clearing media type")
             return
-        if self.select_format(select, format_data):
+        if self.select_format(select, key, format_data):
             return
         if not complete:
             # Retry with complete list
             logger.debug("Selecting 'Show complete list' in media type menu")
             select.select_by_value('showcomplete')
-            select = Select(parent.find_element_by_id('mediatype_all'))
-            if self.select_format(select, format_data):
+            key = 'mediatype_all'
+            select = Select(parent.find_element_by_id(key))
+            if self.select_format(select, key, format_data):
                 return
         format_text = format_data['text']
         format_code = format_data['code']
         if '.X_m' in format_code and format_code not in self.custom_formats:
             # Try to find custom format by name
-            if self.select_custom_format(select, format_data):
+            if self.select_custom_format(select, key, format_data):
                 return
             # Add new media type
             logger.debug("Selecting 'Add media' in media type menu")
@@ -373,7 +873,12 @@ class LibraryThingImporter(LibraryThingRobot):
             change_div = self.driver.find_element_by_id('changemediadiv')
             self.wait_until(EC.visibility_of(change_div))
             set_text(change_div, 'newmedia', format_text)
-            set_select(change_div, 'nestunder', format_code.rsplit('.', 1)[0])
+            pcode, _ = format_code.rsplit('.', 1)
+            set_select(change_div, 'nestunder',
+                       self.custom_formats.get(pcode, pcode))
+            # The new media type will be added when the form is saved
+            self.invalidate_option_index('mediatype')
+            self.invalidate_option_index('mediatype_all')
         else:
             raise RuntimeError(f"Failed to set format {format_text!r} "
                                "({format_code})")
@@ -392,8 +897,7 @@ class LibraryThingImporter(LibraryThingRobot):
         fsid = fs.get_attribute('id')
         logger.debug("Removing %s %d", term, i+1)
         fs.find_element_by_id(f'arbm_{fsid}').click()
-        self.wait_until(
-            lambda _: ('display', 'none') in get_inline_styles(fs))
+        self.wait_for_style(fs, 'display', 'none')
 
     def set_multirow(self, scope, items, set_fn, term):
         """Set multi-row data."""
@@ -525,10 +1029,9 @@ class LibraryThingImporter(LibraryThingRobot):
             # link href attribute
             short = (show_all.get_attribute('href') ==
                      'javascript:book_updateLangMenus(1)')
-        if short and lang_code not in (opt.get_attribute('value')
-                                       for opt in select.options):
-            logger.debug("Clicking 'show all languages' link")
-            show_all.click()
+        if short and lang_code not in self.get_option_index(
+                ('language', elt_id), select).values:
+            self.click_ajax(show_all, "Clicking 'show all languages' link")
             select = Select(self.wait_until(
                 lambda _: parent.find_element_by_tag_name('select')))
         select_by_value(select, lang_code,
@@ -583,20 +1086,25 @@ class LibraryThingImporter(LibraryThingRobot):
         assert len(dates) <= len(rows)
         for i in range(len(dates)):
             row = rows[i]
-            if not row.is_displayed():
+            if not self.is_row_displayed(row, f'dr_start_{i+1}'):
                 assert i > 0
                 logger.debug("Adding reading dates %d", i+1)
                 rows[i-1].find_element_by_css_selector(f'#xmore{i} a').click()
                 self.wait_until(EC.visibility_of(row))
-            set_text(row, f'dr_start_{i+1}', dates[i]['started'])
-            set_text(row, f'dr_end_{i+1}', dates[i]['finished'])
+            set_text(row, f'dr_start_{i+1}', dates[i]['started'], self.form)
+            set_text(row, f'dr_end_{i+1}', dates[i]['finished'], self.form)
         # Clear any additional rows
         for i in range(len(dates), len(rows)):
             row = rows[i]
-            if not row.is_displayed():
+            if not self.is_row_displayed(row, f'dr_start_{i+1}'):
                 break
-            set_text(row, f'dr_start_{i+1}', None)
-            set_text(row, f'dr_end_{i+1}', None)
+            set_text(row, f'dr_start_{i+1}', None, self.form)
+            set_text(row, f'dr_end_{i+1}', None, self.form)
+
+    def is_row_displayed(self, row, field_id):
+        """Check if a row is displayed, using the visibility of a field."""
+        visible = self.form.is_visible(field_id) if self.form else None
+        return row.is_displayed() if visible is None else visible
 
     venue_path_re = re.compile('/venue/([^/]+)')
 
@@ -631,8 +1139,8 @@ class LibraryThingImporter(LibraryThingRobot):
 
     def open_location_popup(self, change_link):
         """Open the location editing popup."""
-        logger.debug("Clicking location %r link", change_link.text)
-        change_link.click()
+        self.click_ajax(change_link, "Clicking location %r link",
+                        change_link.text)
         self.wait_for_lb()
         return self.wait_until(
             EC.presence_of_element_located((By.ID, "pickrecommendations")))
@@ -643,8 +1151,7 @@ class LibraryThingImporter(LibraryThingRobot):
         # attributes so we have to specify it by position in the tree
         remove_link = popup.find_element_by_css_selector(
             ':scope > p:nth-of-type(3) > a')
-        logger.debug("Clicking location remove link")
-        remove_link.click()
+        self.click_ajax(remove_link, "Clicking location remove link")
         self.wait_until(EC.staleness_of(popup))
 
     def select_already_used_venue_id(self, popup, venue_name, venue_id):
@@ -662,9 +1169,8 @@ class LibraryThingImporter(LibraryThingRobot):
         if this_name != venue_name:
             logger.warning("Venue with id %r has name %r, expected %r",
                            venue_id, this_name, venue_name)
-        logger.debug("Selecting already used venue %r, id %r",
-                     this_name, venue_id)
-        anchor.click()
+        self.click_ajax(anchor, "Selecting already used venue %r, id %r",
+                        this_name, venue_id)
         self.wait_until(EC.staleness_of(popup))
         return True
 
@@ -692,12 +1198,12 @@ class LibraryThingImporter(LibraryThingRobot):
         this_venue_id = (self.get_venue_id(venue_anchor) if venue_anchor
                          else None)
         if this_venue_id:
-            logger.debug("Selecting already used venue %r, id %r",
-                         venue_name, this_venue_id)
+            self.click_ajax(anchor, "Selecting already used venue %r, id %r",
+                            venue_name, this_venue_id)
         else:
-            logger.debug("Selecting already used venue %r, free text",
-                         venue_name)
-        anchor.click()
+            self.click_ajax(anchor,
+                            "Selecting already used venue %r, free text",
+                            venue_name)
         self.wait_until(EC.staleness_of(popup))
         return True
 
@@ -717,9 +1223,8 @@ class LibraryThingImporter(LibraryThingRobot):
         submit_button = form.find_element_by_css_selector(
             'input[name="Submit"]')
         results = popup.find_element_by_id('venuelist')
-        logger.debug("Clicking search button")
-        submit_button.click()
-        self.wait_until(lambda _: 'updating' not in get_class_list(results))
+        self.click_ajax(submit_button, "Clicking search button")
+        self.wait_for_class(results, 'updating', False)
         if venue_id:
             venue_link = try_find(
                 results.find_element_by_css_selector,
@@ -754,8 +1259,8 @@ class LibraryThingImporter(LibraryThingRobot):
                 ':scope > a:nth-of-type(2)')
             this_name = venue_name
             this_venue_id = self.get_venue_id(venue_link)
-        logger.debug("Selecting venue %r, id %r", this_name, this_venue_id)
-        anchor.click()
+        self.click_ajax(anchor, "Selecting venue %r, id %r",
+                        this_name, this_venue_id)
         self.wait_until(EC.staleness_of(popup))
         return True
 
@@ -769,12 +1274,25 @@ class LibraryThingImporter(LibraryThingRobot):
         set_text(form, 'textareacomments', from_where)
         submit_button = form.find_element_by_css_selector(
             'input[name="Submit"]')
-        logger.debug("Saving location")
-        submit_button.click()
+        self.click_ajax(submit_button, "Saving location")
         self.wait_until(EC.staleness_of(popup))
 
+    # Map of location names to resolved venue ids, or '' for free text
+    venues = {}
+
     def set_location(self, popup, venue_name, venue_id, has_extra):
         """Use the location editing pop-up to set a location."""
+        if not has_extra and venue_name in self.venues:
+            resolved_id = self.venues[venue_name]
+            if not resolved_id:
+                self.set_from_where_free_text(popup, venue_name)
+                return
+            if self.select_already_used_venue_id(
+                    popup, venue_name, resolved_id):
+                return
+            logger.debug("Resolved venue %r, id %r not found",
+                         venue_name, resolved_id)
+            del self.venues[venue_name]
         # Check for already used venue
         if venue_id and self.select_already_used_venue_id(
                 popup, venue_name, venue_id):
@@ -814,9 +1332,21 @@ class LibraryThingImporter(LibraryThingRobot):
         if curr_name != venue_name or (has_extra and venue_id != curr_id):
             popup = self.open_location_popup(change_link)
             self.set_location(popup, venue_name, venue_id, has_extra)
+            if not has_extra and venue_name not in self.venues:
+                # Remember how the location was resolved for later books
+                parent = self.driver.find_element_by_id('bookedit_datestarted')
+                new_name, new_id, _ = self.parse_from_where(parent)
+                if new_name == venue_name:
+                    self.venues[venue_name] = new_id or ''
+                    self.save_table('venues')
+                else:
+                    logger.debug("Location set to %r, expected %r, not "
+                                 "caching venue", new_name, venue_name)
         return True
 
     def set_or_confirm(self, name, value):
+        if self.form and self.form.has_text(f'form_{name}', value):
+            return
         parent = self.driver.find_element_by_id(f'bookedit_{name}')
         elt_id = f'form_{name}'
         text_elt = parent.find_element_by_id(elt_id)
@@ -824,10 +1354,10 @@ class LibraryThingImporter(LibraryThingRobot):
                 and 'autogeneratedText' in get_class_list(text_elt)):
             confirm_link = parent.find_element_by_css_selector(
                 f'#confirm_{name} a')
-            logger.debug("Clicking 'confirm' link for text field %r", elt_id)
-            confirm_link.click()
-            self.wait_until(
-                lambda _: 'autogeneratedText' not in get_class_list(text_elt))
+            self.click_ajax(confirm_link,
+                            "Clicking 'confirm' link for text field %r",
+                            elt_id)
+            self.wait_for_class(text_elt, 'autogeneratedText', False)
         else:
             set_text_elt(text_elt, value, "text field %r", elt_id)
 
@@ -836,7 +1366,10 @@ class LibraryThingImporter(LibraryThingRobot):
         if self.config.physical_summary == 'auto':
             physical_description = None
         try:
-            set_text(self.driver, 'phys_summary', physical_description)
+            if self.form and self.form.is_visible('phys_summary') is None:
+                raise NoSuchElementException()
+            set_text(self.driver, 'phys_summary', physical_description,
+                     self.form)
         except NoSuchElementException:
             # Add books form doesn't have this field
             # See https://www.librarything.com/topic/330379
@@ -847,28 +1380,30 @@ class LibraryThingImporter(LibraryThingRobot):
         """Set the summary field."""
         if autogen or (autogen is None and self.config.summary == 'auto'):
             summary = None
-        set_text(self.driver, 'form_summary', summary)
+        self.set_plain_field('text', 'form_summary', summary)
 
     def set_barcode(self, barcode):
         """Set the barcode."""
         parent = self.driver.find_element_by_id('bookedit_barcode')
-        text_field = set_text(parent, 'item_inventory_barcode_1', barcode)
+        text_field = set_text(parent, 'item_inventory_barcode_1', barcode,
+                              self.form)
+        if not text_field:
+            return
         # Barcode field has an onblur event to check for duplicate book
         defocus(text_field)
         # We don't currently use the warning but we need to wait for it to
         # appear or it may interfere with saving the form.
         warning = parent.find_element_by_id('barcode_warning_1')
-        self.wait_until(lambda _: 'updating' not in get_class_list(warning))
+        self.wait_for_class(warning, 'updating', False)
 
     def set_bcid(self, bcid):
         """Set the BCID."""
         id1, id2 = bcid.split('-') if bcid else ('', '')
-        set_text(self.driver, 'form_bcid_1', id1)
-        set_text(self.driver, 'form_bcid_2', id2)
+        self.set_plain_field('text', 'form_bcid_1', id1)
+        self.set_plain_field('text', 'form_bcid_2', id2)
 
-    def check_identifier(self, elt, expected, name):
-        """Check if the given text element contains the expected value."""
-        value = elt.get_attribute('value')
+    def check_identifier(self, value, expected, name):
+        """Check if a text field contains the expected value."""
         if expected:
             if not value:
                 logger.warning("Book has no %s value, expected %r",
@@ -883,18 +1418,23 @@ class LibraryThingImporter(LibraryThingRobot):
 
     def check_immutable_identifiers(self, ean, upc, asin, lccn, oclc):
         """Check immutable identifier fields."""
-        driver = self.driver
-        self.check_identifier(driver.find_element_by_css_selector(
-            'input[name="form_ean"]'), ean, 'EAN')
+        if self.form:
+            values = self.form.get_values
+        else:
+            def values(name):
+                return [elt.get_attribute('value') for elt in
+                        self.driver.find_elements_by_css_selector(
+                            f'input[name="{name}"]')]
+        ean_value, = values('form_ean')
+        self.check_identifier(ean_value, ean, 'EAN')
         # ASIN element has same name as UPC, probably a copy-paste error
-        upc_elt, asin_elt = driver.find_elements_by_css_selector(
-            'input[name="form_upc"]')
-        self.check_identifier(upc_elt, upc, 'UPC')
-        self.check_identifier(asin_elt, asin, 'ASIN')
-        self.check_identifier(driver.find_element_by_css_selector(
-            'input[name="form_lccn"]'), lccn, 'LCCN')
-        self.check_identifier(driver.find_element_by_css_selector(
-            'input[name="form_oclc"]'), oclc, 'OCLC')
+        upc_value, asin_value = values('form_upc')
+        self.check_identifier(upc_value, upc, 'UPC')
+        self.check_identifier(asin_value, asin, 'ASIN')
+        lccn_value, = values('form_lccn')
+        self.check_identifier(lccn_value, lccn, 'LCCN')
+        oclc_value, = values('form_oclc')
+        self.check_identifier(oclc_value, oclc, 'OCLC')
 
     def set_privacy(self, public):
         """Set the book's privacy status."""
@@ -904,24 +1444,36 @@ class LibraryThingImporter(LibraryThingRobot):
             private = False
         else:
             private = (public == '0')
-        set_checkbox(self.driver, 'books_private', private)
+        self.set_plain_field('checkbox', 'books_private', private)
 
     def save_changes(self):
         """Save book edits."""
         save_button = self.driver.find_element_by_id('book_editTabTextSave2')
         self.click_link(save_button, 'Clicking save button')
+        self.form = None
 
-    def set_book_fields(self, book_id, book_data):
-        """Populate the fields of the add/edit book form and save changes."""
+    def set_book_fields(self, book_id, book_data, save=True):
+        """Populate the fields of the add/edit book form.
+
+        Changes are saved unless ``save`` is false.
+        """
         extra_data = book_data.get('_extra', {})
+        # Read the current state of all form fields at once
+        self.form = FormSnapshot(self.driver)
+        # Select options are cached by page type, e.g. /work/N/edit/N
+        self.page_type = re.sub(
+            '[0-9]+', 'N', urlparse(self.driver.current_url).path)
+        # Queue simple fields to be written together at the end
+        if not self.config.no_bulk_write:
+            self.pending_fields = {}
 
         # Title
-        set_text(self.driver, 'form_title', book_data['title'])
+        self.set_plain_field('text', 'form_title', book_data['title'])
 
         # Sort character
-        set_select(self.driver, 'sortcharselector',
-                   # default selection has value "999"
-                   book_data.get('sortcharacter', '999'))
+        self.set_plain_field('select', 'sortcharselector',
+                             # default selection has value "999"
+                             book_data.get('sortcharacter', '999'))
 
         # Primary author
         authors = book_data.get('authors')
@@ -940,7 +1492,7 @@ class LibraryThingImporter(LibraryThingRobot):
 
         # Review
         review = book_data.get('review')
-        set_text(self.driver, 'form_review', review)
+        self.set_plain_field('text', 'form_review', review)
         self.set_review_language(book_data.get('reviewlang'))
 
         # Other authors
@@ -953,13 +1505,15 @@ class LibraryThingImporter(LibraryThingRobot):
         self.set_format(get_path(book_data, 'format', 0))
 
         # Publication details
-        set_text(self.driver, 'form_date', book_data.get('date'))
-        set_text(self.driver, 'form_publication', book_data.get('publication'))
-        set_text(self.driver, 'form_ISBN', book_data.get('originalisbn'))
+        self.set_plain_field('text', 'form_date', book_data.get('date'))
+        self.set_plain_field('text', 'form_publication',
+                             book_data.get('publication'))
+        self.set_plain_field('text', 'form_ISBN',
+                             book_data.get('originalisbn'))
 
         # Physical description
-        set_text(self.driver, 'numVolumes', book_data.get('volumes'))
-        set_text(self.driver, 'form_copies', book_data.get('copies'))
+        self.set_plain_field('text', 'numVolumes', book_data.get('volumes'))
+        self.set_plain_field('text', 'form_copies', book_data.get('copies'))
         self.set_paginations(book_data.get('pages'))
         self.set_dimensions(book_data.get('height'), book_data.get('length'),
                             book_data.get('thickness'))
@@ -975,7 +1529,8 @@ class LibraryThingImporter(LibraryThingRobot):
         }))
 
         # Date acquired
-        set_text(self.driver, 'form_datebought', book_data.get('dateacquired'))
+        self.set_plain_field('text', 'form_datebought',
+                             book_data.get('dateacquired'))
 
         # From where
         self.set_from_where(book_data.get('fromwhere'),
@@ -983,16 +1538,17 @@ class LibraryThingImporter(LibraryThingRobot):
 
         # Classification
         self.set_or_confirm('lccallnumber', get_path(book_data, 'lcc', 'code'))
-        set_text(self.driver, 'form_lexile', extra_data.get('lexile'))
+        set_text(self.driver, 'form_lexile', extra_data.get('lexile'),
+                 self.form)
         self.set_or_confirm('dewey', extra_data.get(
             'dewey', get_path(book_data, 'ddc', 'code', 0)))
         set_text(self.driver, 'form_btc_callnumber',
-                 get_path(book_data, 'callnumber', 0))
+                 get_path(book_data, 'callnumber', 0), self.form)
 
         # Comments
-        set_text(self.driver, 'form_comments', book_data.get('comment'))
-        set_text(self.driver, 'form_privatecomment',
-                 book_data.get('privatecomment'))
+        self.set_plain_field('text', 'form_comments', book_data.get('comment'))
+        self.set_plain_field('text', 'form_privatecomment',
+                             book_data.get('privatecomment'))
 
         # Summary
         self.set_physical_summary(book_data.get('physical_description'))
@@ -1001,7 +1557,6 @@ class LibraryThingImporter(LibraryThingRobot):
 
         # Identifiers
         # TODO: Set book id as barcode if none specified
-        # TODO: Check for existing book
         self.set_barcode(get_path(book_data, 'barcode', '1'))
         self.set_bcid(book_data.get('bcid'))
         self.check_immutable_identifiers(
@@ -1015,7 +1570,10 @@ class LibraryThingImporter(LibraryThingRobot):
         # Private flag
         self.set_privacy(book_data.get('public'))
 
-        self.save_changes()
+        if self.pending_fields is not None:
+            self.write_fields()
+        if save:
+            self.save_changes()
 
     def parse_source_list(self, scope):
         """Parse the list of available sources in the add books form."""
@@ -1030,7 +1588,7 @@ class LibraryThingImporter(LibraryThingRobot):
     featured_sources = {}
     all_sources = {}
 
-    def parse_sources(self, section, sources):
+    def parse_sources(self, section, table):
         """Parse list of sources."""
         logger.debug("Parsing sources in section %r",
                      section.get_attribute('id'))
@@ -1041,31 +1599,35 @@ class LibraryThingImporter(LibraryThingRobot):
                 "text": elt.innerText,
                 "sourceId": elt.dataset.sourceId,
             }));"""), section)
+        sources = getattr(self, table)
         for item in link_info:
             sources[item['text'].casefold()] = item['sourceId']
+        self.save_table(table)
 
-    def add_source_in_section(self, scope, section, sources, lsource):
+    def add_source_in_section(self, scope, section, table, lsource):
         """Add a source in a given section of the add sources lightbox."""
-        if not sources:
-            self.parse_sources(section, sources)
+        sources = getattr(self, table)
+        if not sources or (lsource not in sources and self.is_stale(table)):
+            self.parse_sources(section, table)
         source_id = sources.get(lsource)
         if not source_id:
             return False
         link = section.find_element_by_css_selector(
             f'#libraryAddContainer a[data-source-id="{source_id}"]')
         if link.get_attribute('data-library-added') != '1':
-            logger.debug("Adding source %r, id %r", link.text, source_id)
-            link.click()
-            self.wait_until(
-                lambda _: link.get_attribute('data-library-added-new') == '1')
-            self.wait_until(
-                lambda _: 'updating' not in get_class_list(scope))
+            self.click_ajax(link, "Adding source %r, id %r",
+                            link.text, source_id)
+            self.wait_for_script(
+                "return arguments[0].dataset.libraryAddedNew === '1';", link)
+            self.wait_for_class(scope, 'updating', False)
         return True
 
     def add_source_lb(self, scope, lb_content, lsource, have_overcat):
         """Add a source using the lightbox."""
         # Short-circuit if the specified source is already known to be absent
         if (self.featured_sources and self.all_sources
+                and not {'featured_sources', 'all_sources'}
+                & self.cached_tables
                 and lsource not in self.featured_sources
                 and lsource not in self.all_sources):
             # Make sure Overcat is available
@@ -1073,12 +1635,12 @@ class LibraryThingImporter(LibraryThingRobot):
                 featured_section = lb_content.find_element_by_id(
                     'section_featured')
                 self.add_source_in_section(
-                    scope, featured_section, self.featured_sources, 'overcat')
+                    scope, featured_section, 'featured_sources', 'overcat')
             return False
         # Look in featured sources section
         featured_section = lb_content.find_element_by_id('section_featured')
         if self.add_source_in_section(
-                scope, featured_section, self.featured_sources, lsource):
+                scope, featured_section, 'featured_sources', lsource):
             return True
         # Look in all sources section
         allsources_section = lb_content.find_element_by_id(
@@ -1087,7 +1649,7 @@ class LibraryThingImporter(LibraryThingRobot):
         lb_content.find_element_by_id('menu_allsources').click()
         self.wait_until(EC.visibility_of(allsources_section))
         if self.add_source_in_section(
-                scope, allsources_section, self.all_sources, lsource):
+                scope, allsources_section, 'all_sources', lsource):
             return True
         # Didn't find source; make sure Overcat is available
         if not have_overcat:
@@ -1095,33 +1657,86 @@ class LibraryThingImporter(LibraryThingRobot):
             lb_content.find_element_by_id('menu_featured').click()
             self.wait_until(EC.visibility_of(featured_section))
             self.add_source_in_section(
-                scope, featured_section, self.featured_sources, 'overcat')
+                scope, featured_section, 'featured_sources', 'overcat')
         return False
 
     def add_source(self, scope, lsource, have_overcat):
         """Add a source."""
         add_link = scope.find_element_by_css_selector(
             ':scope > div > a:nth-of-type(2)')
-        logger.debug("Opening add source popup")
-        add_link.click()
+        self.click_ajax(add_link, "Opening add source popup")
         lb_content = self.wait_for_lb()
         found = self.add_source_lb(scope, lb_content, lsource, have_overcat)
         # Close lightbox
         self.close_lb(lb_content, "Closing add source popup")
         return found
 
+    # Map of lowercase source names to radio button values, and set of
+    # sources known to be unavailable, shared across workers
+    source_values = {}
+    missing_sources = set()
+
+    def parse_source_values(self, scope):
+        """Read the names and values of all source radio buttons at once."""
+        self.source_values.update(self.driver.execute_script(dedent("""\
+            return Array.from(arguments[0].querySelectorAll(
+                    'input[type="radio"][name="libraryChoice"]'),
+                rb => [rb.parentElement.querySelector('label')
+                       .innerText.toLowerCase(), rb.value]);
+            """), scope))
+
+    def prepare_sources(self, sources):
+        """Add sources to the source list before importing books."""
+        self.navigate(self.url('/addbooks'))
+        parent = self.driver.find_element_by_id('yourlibrarylist')
+        rbs = self.parse_source_list(parent)
+        for source in sorted(sources):
+            lsource = source.casefold()
+            if lsource in rbs:
+                continue
+            if not self.add_source(parent, lsource, 'overcat' in rbs):
+                logger.info("Source %r is not available", source)
+                self.missing_sources.add(lsource)
+            parent = self.driver.find_element_by_id('yourlibrarylist')
+            self.wait_for_class(parent, 'updating', False)
+            rbs = self.parse_source_list(parent)
+        self.parse_source_values(parent)
+
+    select_source_script = dedent("""\
+        const rb = Array.from(arguments[0].querySelectorAll(
+                'input[type="radio"][name="libraryChoice"]'))
+            .find(rb => rb.value === arguments[1]);
+        if (!rb) {
+            return false;
+        }
+        if (!rb.checked) {
+            rb.click();
+        }
+        return true;""")
+
     def select_source(self, source):
         """Select a book data source."""
         lsource = source.casefold()
+        found = lsource not in self.missing_sources
+        value = self.source_values.get(lsource if found else 'overcat')
+        if value is not None:
+            logger.debug("Selecting source %r (%s)",
+                         source if found else 'Overcat', value)
+            if self.driver.execute_script(
+                    self.select_source_script,
+                    self.driver.find_element_by_id('yourlibrarylist'), value):
+                return found
         parent = self.driver.find_element_by_id('yourlibrarylist')
         rbs = self.parse_source_list(parent)
         found = lsource in rbs
         if not found:
             found = self.add_source(parent, lsource, 'overcat' in rbs)
             parent = self.driver.find_element_by_id('yourlibrarylist')
-            self.wait_until(
-                lambda _: 'updating' not in get_class_list(parent))
+            self.wait_for_class(parent, 'updating', False)
             rbs = self.parse_source_list(parent)
+            self.parse_source_values(parent)
+            if not found:
+                self.missing_sources.add(lsource)
         if found:
             rb, rb_name = rbs[lsource]
         else:
@@ -1154,9 +1769,30 @@ class LibraryThingImporter(LibraryThingRobot):
                 return identifier, value
         return None, None
 
-    def add_from_source(self, book_id, book_data, source):
-        """Add a new book from the given source."""
-        self.driver.get('https://www.librarything.com/addbooks')
+    # All sessions share the account's list of added books, so a session
+    # holds this lock from adding a book until it has found it in the list
+    add_lock = threading.Lock()
+
+    def record_created(self, book_id, book_data):
+        """Record the last added book, and return its edit link."""
+        last_added_book, work_id, new_book_id = self.check_work_id(
+            book_data.get('workcode'))
+        edit_link = last_added_book.find_element_by_css_selector(
+            '.icons > div:nth-of-type(1) > a')
+        # The book now exists, so a re-run should edit it rather than adding
+        # it again
+        self.record_progress(book_id, 'created', work_id=work_id,
+                             book_id=new_book_id,
+                             edit_url=edit_link.get_attribute('href'))
+        return edit_link
+
+    def add_from_source(self, book_id, book_data, source, edit=True):
+        """Add a new book from the given source.
+
+        If ``edit`` is false, the book is only created and its fields are not
+        set.
+        """
+        self.navigate(self.url('/addbooks'), reuse=True)
         identifier, value = self.get_identifier(book_data)
         if not value:
             return False
@@ -1172,8 +1808,8 @@ class LibraryThingImporter(LibraryThingRobot):
                 'input[name="form_tags"]')
             set_text_elt(tags_elt, self.config.tag, "tags to add")
             defocus(tags_elt)
-        logger.debug("Clicking search button")
-        self.driver.find_element_by_id('search_btn').click()
+        self.click_ajax(self.driver.find_element_by_id('search_btn'),
+                        "Clicking search button")
         self.wait_until(EC.invisibility_of_element_located(
             (By.ID, 'addbooks_ajax_status')), 30)
         bookframe = self.driver.find_element_by_id('bookframe')
@@ -1183,46 +1819,227 @@ class LibraryThingImporter(LibraryThingRobot):
         # TODO: Fallback if not found
         first_result = bookframe.find_element_by_css_selector(
             'td.result > div.addbooks_title > a')
-        logger.debug("Clicking search result %r", first_result.text)
-        first_result.click()
-        self.wait_until(EC.invisibility_of_element_located(
-            (By.ID, 'addbooks_ajax_status')))
-        bookframe = self.driver.find_element_by_id('bookframe')
-        self.wait_until(
-            lambda _: ('opacity', '1') in get_inline_styles(bookframe))
-        last_added_book = self.driver.find_element_by_css_selector(
-            '#bookframe .booklist .book')
-        edit_link = last_added_book.find_element_by_css_selector(
-            '.icons > div:nth-of-type(1) > a')
+        with self.add_lock:
+            self.click_ajax(first_result, "Clicking search result %r",
+                            first_result.text)
+            self.wait_until(EC.invisibility_of_element_located(
+                (By.ID, 'addbooks_ajax_status')))
+            bookframe = self.driver.find_element_by_id('bookframe')
+            self.wait_for_style(bookframe, 'opacity', '1')
+            edit_link = self.record_created(book_id, book_data)
+        if not edit:
+            return True
         self.click_link(edit_link, "Clicking edit link for last added book")
         self.set_book_fields(book_id, book_data)
         return True
 
     def add_manually(self, book_id, book_data):
-        """Add a new book using the manual entry form."""
-        self.driver.get('https://www.librarything.com/addnew.php')
-        self.set_book_fields(book_id, book_data)
+        """Add a new book using the manual entry form.
+
+        Returns the work id and book id of the new book.
+        """
+        self.navigate(self.url('/addnew.php'), reuse=True)
+        self.set_book_fields(book_id, book_data, save=False)
+        with self.add_lock:
+            self.save_changes()
+            _, work_id, new_book_id = self.check_work_id(
+                book_data.get('workcode'))
+        return work_id, new_book_id
+
+    # HTTP session for submitting forms directly, created on first use
+    session = None
+
+    def can_post(self, book_data):
+        """Check whether a book only uses fields supported by add_by_post.
+
+        Other fields are set by flows that need JavaScript, such as the venue
+        search, or by rows that are added dynamically.
+        """
+        extra_data = book_data.get('_extra', {})
+        authors = book_data.get('authors') or []
+        format_data = get_path(book_data, 'format', 0)
+        return not (
+            extra_data.get('secondary_authors', authors[1:])
+            or book_data.get('reviewlang')
+            or (format_data and format_data['code'] not in
+                self.custom_formats and '.X_m' in format_data['code'])
+            or book_data.get('pages') or book_data.get('height')
+            or book_data.get('length') or book_data.get('thickness')
+            or book_data.get('weight')
+            or any(extra_data.get('languages', {}).values())
+            or book_data.get('language') or book_data.get('originallanguage')
+            or any(extra_data.get('reading_dates', ()))
+            or book_data.get('datestarted') or book_data.get('dateread')
+            or book_data.get('fromwhere') or extra_data.get('from_where')
+            or not set(book_data['collections']) <= self.collection_ids.keys()
+        )
+
+    def post_fields(self, book_data):
+        """Get the values of the add book form fields, by element id."""
+        extra_data = book_data.get('_extra', {})
+        tags = list(book_data.get('tags') or [])
+        if self.config.tag:
+            tags.append(self.config.tag)
+        format_data = get_path(book_data, 'format', 0)
+        format_code = format_data['code'] if format_data else ''
+        summary = book_data.get('summary')
+        autogen = extra_data.get('summary_autogenerated')
+        if autogen or (autogen is None and self.config.summary == 'auto'):
+            summary = None
+        bcid = book_data.get('bcid')
+        if self.config.private:
+            private = True
+        elif self.config.public:
+            private = False
+        else:
+            private = book_data.get('public') == '0'
+        fields = {
+            'form_title': book_data['title'],
+            'sortcharselector': book_data.get('sortcharacter', '999'),
+            'form_authorunflip': get_path(book_data, 'authors', 0, 'lf'),
+            'form_tags': ", ".join(tags),
+            'form_rating': str(int(book_data.get('rating', 0) * 2)),
+            'form_review': book_data.get('review'),
+            'mediatype': self.custom_formats.get(format_code, format_code),
+            'form_date': book_data.get('date'),
+            'form_publication': book_data.get('publication'),
+            'form_ISBN': book_data.get('originalisbn'),
+            'numVolumes': book_data.get('volumes'),
+            'form_copies': book_data.get('copies'),
+            'form_datebought': book_data.get('dateacquired'),
+            'form_lccallnumber': get_path(book_data, 'lcc', 'code'),
+            'form_lexile': extra_data.get('lexile'),
+            'form_dewey': extra_data.get(
+                'dewey', get_path(book_data, 'ddc', 'code', 0)),
+            'form_btc_callnumber': get_path(book_data, 'callnumber', 0),
+            'form_comments': book_data.get('comment'),
+            'form_privatecomment': book_data.get('privatecomment'),
+            'form_summary': summary,
+            'item_inventory_barcode_1': get_path(book_data, 'barcode', '1'),
+            'form_bcid_1': bcid.split('-')[0] if bcid else '',
+            'form_bcid_2': bcid.split('-')[1] if bcid else '',
+            'books_private': private,
+        }
+        cnames = set(book_data['collections'])
+        for cname, cid in self.collection_ids.items():
+            fields[cid] = cname in cnames
+        return fields
+
+    def post_data(self, book_data):
+        """Fetch the add book form and fill in the values for a book.
+
+        Returns the URL to submit the form to and the list of (name, value)
+        pairs to submit, or None if the form has no field for some value,
+        e.g. a custom author role.
+        """
+        if self.session is None:
+            self.session = http_session()
+            add_session_cookies(self.session, self.driver.get_cookies())
+        logger.debug("Fetching add book form")
+        self.scheduler.acquire()
+        response = self.session.get(self.url('/addnew.php'), timeout=30)
+        response.raise_for_status()
+        soup = BeautifulSoup(response.text, 'html.parser')
+        form = soup.find(id='form_title').find_parent('form')
+        # Start with the values a browser would submit by default
+        controls = form.select('input[name], select[name], textarea[name]')
+        payload = [[elt['name'], form_value(elt)] for elt in controls]
+        fields = {elt.get('id'): field
+                  for elt, field in zip(controls, payload)}
+        for elt_id, value in self.post_fields(book_data).items():
+            field = fields.get(elt_id)
+            if field is None:
+                if value:
+                    logger.debug("Form field %r not found", elt_id)
+                    return None
+            elif isinstance(value, bool):
+                elt = form.find(id=elt_id)
+                field[1] = elt.get('value', 'on') if value else None
+            else:
+                field[1] = '' if value is None else str(value)
+                elt = form.find(id=elt_id)
+                if elt.name == 'select' and field[1] not in {
+                        option.get('value', option.get_text())
+                        for option in elt.find_all('option')}:
+                    # e.g. a media type only in the complete list
+                    logger.debug("Option %r of %r not found", field[1],
+                                 elt_id)
+                    return None
+        role = get_path(book_data, 'authors', 0, 'role') or ''
+        role_field = fields.get('person_role--1')
+        if role_field:
+            for option in form.find(id='person_role--1').find_all('option'):
+                if (option.get_text().strip() if role
+                        else option.get('value')) == role:
+                    role_field[1] = option.get('value', option.get_text())
+                    break
+            else:
+                logger.debug("Author role %r not found", role)
+                return None
+        data = [(name, value) for name, value in payload
+                if value is not None]
+        return urljoin(response.url, form.get('action', '')), data
+
+    def add_by_post(self, book_id, book_data):
+        """Add a new book by submitting the manual entry form over HTTP.
+
+        Returns the work id and book id of the new book, or None if the book
+        can't be added this way.
+        """
+        post_data = self.post_data(book_data)
+        if post_data is None:
+            logger.info("Unable to add book %s by form post, using the "
+                        "browser", book_id)
+            return None
+        url, data = post_data
+        with self.add_lock:
+            logger.debug("Submitting add book form with %d fields",
+                         len(data))
+            self.scheduler.acquire()
+            response = self.session.post(url, data=data, timeout=30)
+            response.raise_for_status()
+            if urlparse(response.url).path != '/addbooks':
+                raise RuntimeError(
+                    f"Unexpected response URL: {response.url}")
+            anchor = BeautifulSoup(response.text, 'html.parser').select_one(
+                '#bookframe .booklist .book > h2 > a')
+            if anchor is None:
+                # The list of added books may be loaded by a script
+                self.navigate(self.url('/addbooks'))
+                _, work_id, new_book_id = self.check_work_id(
+                    book_data.get('workcode'))
+                return work_id, new_book_id
+        match = self.book_url_path_re.match(urlparse(anchor['href']).path)
+        logger.info("Created book with id %s, work id %s",
+                    match.group(2), match.group(1))
+        return match.group(1), match.group(2)
 
     book_url_path_re = re.compile('/work/([0-9]+)/book/([0-9]+)')
 
-    def check_work_id(self, expected_work_id):
-        """Check the work id of a newly created book."""
-        assert (self.driver.current_url ==
-                'https://www.librarything.com/addbooks')
-        self.wait_until(EC.visibility_of_element_located((By.ID, 'bookframe')))
+    def parse_last_added_book(self):
+        """Find the last added book and its work and book ids."""
         last_added_book = self.driver.find_element_by_css_selector(
             '#bookframe .booklist .book')
         anchor = last_added_book.find_element_by_css_selector(
             ':scope > h2 > a')
         path = urlparse(anchor.get_attribute('href')).path
         match = self.book_url_path_re.match(path)
-        work_id = match.group(1)
-        book_id = match.group(2)
+        return last_added_book, match.group(1), match.group(2)
+
+    def check_work_id(self, expected_work_id):
+        """Check the work id of a newly created book.
+
+        Returns the book's entry in the list of added books, and its work id
+        and book id. The caller must hold ``add_lock`` since adding the book.
+        """
+        assert self.driver.current_url == self.url('/addbooks')
+        self.wait_until(EC.visibility_of_element_located((By.ID, 'bookframe')))
+        last_added_book, work_id, book_id = self.parse_last_added_book()
         logger.info("Created book with id %s, work id %s", book_id, work_id)
         if expected_work_id and work_id != expected_work_id:
             logger.warning("Book id %s has work id %s, expected %s",
                            book_id, work_id, expected_work_id)
-        return work_id, book_id
+        return last_added_book, work_id, book_id
 
     ctypes = {
         'cc': '1',
@@ -1251,8 +2068,7 @@ class LibraryThingImporter(LibraryThingRobot):
         submit = confirm.find_element_by_css_selector('input[type="submit"]')
         if info:
             # Variant 1: Cover info dialog
-            logger.debug("Confirming cover selection")
-            submit.click()
+            self.click_ajax(submit, "Confirming cover selection")
             alert = self.wait_until(EC.alert_is_present())
             alert.accept()
         else:
@@ -1300,14 +2116,15 @@ class LibraryThingImporter(LibraryThingRobot):
         """Parse cover ids for blank covers."""
         logger.debug("Parsing blank cover ids")
         div = self.driver.find_element_by_id('memberblank')
-        logger.debug("Clicking 'show all' link for blank covers")
-        div.find_element_by_css_selector('p.limitedlink a').click()
-        self.wait_until(lambda _: 'showall' in get_class_list(div))
+        self.click_ajax(div.find_element_by_css_selector('p.limitedlink a'),
+                        "Clicking 'show all' link for blank covers")
+        self.wait_for_class(div, 'showall')
         for elt in div.find_elements_by_css_selector('a.blankcoverpick'):
             qs = parse_qs(urlparse(elt.get_attribute('href')).query)
             assert qs['type'] == ['1']
             cid, = qs['id']
             self.blank_covers.add(f'cc_{cid}')
+        self.save_table('blank_covers')
 
     def set_default_cover(self, book_id):
         """Set cover to user default."""
@@ -1322,13 +2139,53 @@ class LibraryThingImporter(LibraryThingRobot):
         elt = div.find_element_by_css_selector(
             f'a.blankcoverpick[href$="&type=1&id={cid}"]')
         if not elt.is_displayed():
-            logger.debug("Clicking 'show all' link for blank covers")
-            div.find_element_by_css_selector('p.limitedlink a').click()
-            self.wait_until(lambda _: 'showall' in get_class_list(div))
+            self.click_ajax(
+                div.find_element_by_css_selector('p.limitedlink a'),
+                "Clicking 'show all' link for blank covers")
+            self.wait_for_class(div, 'showall')
         self.click_link(elt, "Selecting blank cover with id %r", cid)
 
+    # Samples the element's bounding box on every animation frame, scrolling
+    # it back into view whenever it moves
+    location_stable_script = dedent("""\
+        const [elt, settle, timeout] = arguments;
+        const done = arguments[arguments.length - 1];
+        // Animation frames aren't run in background tabs
+        const frame = document.hidden ? cb => setTimeout(cb, 16)
+                                       : cb => requestAnimationFrame(cb);
+        const start = performance.now();
+        let prevRect = null;
+        let stableSince = start;
+        const sample = () => {
+            const now = performance.now();
+            const r = elt.getBoundingClientRect();
+            const rect = [r.left, r.top, r.width, r.height].join();
+            if (rect !== prevRect) {
+                prevRect = rect;
+                stableSince = now;
+                elt.scrollIntoView({block: 'center'});
+            } else if (now - stableSince >= settle) {
+                done(true);
+                return;
+            }
+            if (now - start > timeout) {
+                done(false);
+                return;
+            }
+            frame(sample);
+        };
+        elt.scrollIntoView({block: 'center'});
+        frame(sample);""")
+
     def wait_until_location_stable(self, elt):
-        """Attempt to wait until an element's location is stable."""
+        """Wait until an element's location is stable."""
+        stable = self.execute_wait_script(
+            self.location_stable_script, elt, self.config.settle_time, 30000,
+            seconds=30)
+        if stable is not None:
+            if not stable:
+                raise TimeoutError("Element location failed to stabilize")
+            return
         prev_location = None
         self.driver.execute_script(
             "arguments[0].scrollIntoView({block: 'center'});", elt)
@@ -1345,17 +2202,16 @@ class LibraryThingImporter(LibraryThingRobot):
     def set_cover_from_list(self, div_id, term, cover_id, cpfx, cid):
         """Set cover by id from the specified section."""
         div = self.driver.find_element_by_id(div_id)
-        self.wait_until(lambda _: 'updating' not in get_class_list(div))
+        self.wait_for_class(div, 'updating', False)
         cover_div_id = f'am_{cid}' if cpfx == 'isbn' else cover_id
         cover_div = try_find(div.find_element_by_id, cover_div_id)
         if not cover_div:
             show_all = try_find(div.find_element_by_css_selector,
                                 'p.limitedlink a')
             if show_all:
-                logger.debug("Clicking 'show all' link for %s covers", term)
-                show_all.click()
-                self.wait_until(
-                    lambda _: 'updating' not in get_class_list(div))
+                self.click_ajax(show_all,
+                                "Clicking 'show all' link for %s covers", term)
+                self.wait_for_class(div, 'updating', False)
                 cover_div = try_find(div.find_element_by_id, cover_div_id)
             if not cover_div:
                 return False  # Cover not found
@@ -1401,8 +2257,8 @@ class LibraryThingImporter(LibraryThingRobot):
         if confirmed is False:
             # Don't set cover if source cover was chosen automatically
             return
-        self.driver.get(
-            f'https://www.librarything.com/work/{work_id}/covers/{book_id}')
+        self.navigate(self.url(f'/work/{work_id}/covers/{book_id}'),
+                      reuse=True)
         cpfx, cid = cover_id.split('_', 1)
         # As a short-cut, check if the current cover already matches
         if self.check_and_confirm_cover(cover_id, cpfx, cid):
@@ -1413,15 +2269,16 @@ class LibraryThingImporter(LibraryThingRobot):
         # which can lead to unpredictable stale element reference errors when
         # trying to select a cover. As a workaround, wait for all ajax requests
         # to complete before proceeding.
-        self.wait_until(
-            lambda wd: wd.execute_script('return jQuery.active === 0;'))
+        self.wait_for_script('return jQuery.active === 0;')
         found = False
         if cpfx == 'cc':
             if cid == '1':
                 self.set_default_cover(book_id)
                 found = True
             else:
-                if not self.blank_covers:
+                if not self.blank_covers or (
+                        cover_id not in self.blank_covers
+                        and self.is_stale('blank_covers')):
                     self.parse_blank_covers()
                 if cover_id in self.blank_covers:
                     self.set_blank_cover(cid)
@@ -1433,17 +2290,68 @@ class LibraryThingImporter(LibraryThingRobot):
         if not found:
             logger.warning("Unable to find cover with id %r", cover_id)
 
-    def add_book(self, book_id, book_data):
-        """Add a new book."""
-        logger.info("Adding book %s: %s", book_id, book_data['title'])
+    def create_book(self, book_id, book_data):
+        """Create a new book with only its title and tag."""
+        logger.info("Creating book %s: %s", book_id, book_data['title'])
         source = book_data.get('source')
-        added = False
         if source and source != 'manual entry' and not config.no_source:
-            added = self.add_from_source(book_id, book_data, source)
-        if not added:
-            self.add_manually(book_id, book_data)
-        new_work_id, new_book_id = self.check_work_id(
-            book_data.get('workcode'))
+            if self.add_from_source(book_id, book_data, source, edit=False):
+                return
+        self.navigate(self.url('/addnew.php'), reuse=True)
+        set_text(self.driver, 'form_title', book_data['title'])
+        if self.config.tag:
+            field = set_text(self.driver, 'form_tags', self.config.tag)
+            defocus(field)
+        with self.add_lock:
+            self.save_changes()
+            self.record_created(book_id, book_data)
+
+    def add_book(self, book_id, book_data):
+        """Add a new book, or resume adding a partially imported book.
+
+        With the 'create' or 'edit' phase, only the book creation or field
+        editing step is done.
+        """
+        progress = self.progress.get(book_id)
+        step = progress['step'] if progress else None
+        if step is None and self.config.phase == 'create':
+            self.create_book(book_id, book_data)
+            return
+        if step is None:
+            logger.info("Adding book %s: %s", book_id, book_data['title'])
+            source = book_data.get('source')
+            added = False
+            if source and source != 'manual entry' and not config.no_source:
+                added = self.add_from_source(book_id, book_data, source)
+            if added:
+                # The ids were read from the list of added books before the
+                # book was edited
+                new_work_id = self.progress[book_id]['work_id']
+                new_book_id = self.progress[book_id]['book_id']
+            else:
+                new_ids = None
+                if self.config.post and self.can_post(book_data):
+                    new_ids = self.add_by_post(book_id, book_data)
+                if new_ids is None:
+                    new_ids = self.add_manually(book_id, book_data)
+                new_work_id, new_book_id = new_ids
+            self.record_progress(book_id, 'saved', work_id=new_work_id,
+                                 book_id=new_book_id)
+        else:
+            new_work_id = progress['work_id']
+            new_book_id = progress['book_id']
+            if step == 'created':
+                logger.info("Resuming book %s: editing new book %s",
+                            book_id, new_book_id)
+                self.navigate(progress['edit_url'])
+                self.set_book_fields(book_id, book_data)
+                self.record_progress(book_id, 'saved', work_id=new_work_id,
+                                     book_id=new_book_id)
+            else:
+                logger.info("Resuming book %s: setting cover of new book %s",
+                            book_id, new_book_id)
+        if self.config.phase == 'edit':
+            return
         cover_data = get_path(book_data, '_extra', 'cover')
         if cover_data and not self.config.no_covers:
             try:
@@ -1453,18 +2361,93 @@ class LibraryThingImporter(LibraryThingRobot):
                                new_book_id, exc_info=True)
                 if config.debug_mode:
                     input("\aPress enter to continue: ")
+                return
+        self.record_progress(book_id, 'done', work_id=new_work_id,
+                             book_id=new_book_id)
+
 
+# Progress steps of the books processed in each phase
+PHASE_STEPS = {
+    'create': (None,),
+    'edit': ('created',),
+    'cover': ('saved',),
+    'all': (None, 'created', 'saved'),
+}
 
-def main(config, data):
+
+def is_pending(config, progress, book_id):
+    """Check whether a book needs to be processed in the current phase."""
+    step = progress.get(book_id, {}).get('step')
+    return step in PHASE_STEPS[config.phase]
+
+
+def is_existing(index, book_id, book_data):
+    """Check whether a book is already in the library."""
+    existing_id, key_type = index.find(book_id, book_data)
+    if existing_id:
+        logger.info("Skipping book %s, matches existing book %s by %s",
+                    book_id, existing_id, key_type)
+        return True
+    return False
+
+
+def main(config, data, progress, ledger=None, index=None):
     """Import JSON data into LibraryThing."""
+    # Books to skip, and collections, custom media types and sources used by
+    # the remaining steps of the selected books
+    skipped = set()
+    cnames = set()
+    formats = {}
+    sources = set()
+    for book_id in config.book_ids or data:
+        if book_id not in data:
+            continue
+        book_data = data[book_id]
+        step = progress.get(book_id, {}).get('step')
+        # Books already created by this import are not checked against the
+        # existing library, which may include them
+        if not is_pending(config, progress, book_id) or (
+                step is None and index
+                and is_existing(index, book_id, book_data)):
+            skipped.add(book_id)
+            continue
+        if step == 'created' or (step is None and config.phase != 'create'):
+            # Book fields will be set
+            cnames.update(book_data['collections'])
+            format_data = get_path(book_data, 'format', 0)
+            if format_data and '.X_m' in format_data['code']:
+                formats[format_data['code']] = format_data['text']
+        source = book_data.get('source')
+        if (step is None and source and source != 'manual entry'
+                and not config.no_source):
+            sources.add(source)
+    prepared = False
 
     def init_fn(driver):
-        ltrobot = LibraryThingImporter(config, driver)
+        nonlocal prepared
+        ltrobot = LibraryThingImporter(config, driver, progress, ledger)
         ltrobot.login()
+        if not prepared:
+            # Only the first session sets up collections, media types and
+            # sources, before the other workers are started
+            prepared = True
+            if config.cache_file:
+                username = ltrobot.get_username()
+                if username:
+                    LibraryThingImporter.load_cache(LookupCache(
+                        config.cache_file, config.cache_ttl, username))
+                else:
+                    logger.warning("Unable to find the account name, not "
+                                   "using cache file %r", config.cache_file)
+            try:
+                ltrobot.prepare(cnames, formats, sources)
+            except Exception:
+                logger.warning("Exception preparing import", exc_info=True)
         return ltrobot
 
     return main_loop(config, data, 'import', init_fn,
-                     LibraryThingImporter.add_book)
+                     LibraryThingImporter.add_book,
+                     lambda book_id, _: book_id in skipped)
 
 
 def parse_search_by(config):
@@ -1486,6 +2469,36 @@ def add_extra_data(data, extra_file):
             data[book_id]['_extra'] = extra_data['_extra']
 
 
+def group_books(config, data):
+    """Group the selected books by source, add path and cover type.
+
+    Book ids are not changed, so the errors file still refers to the original
+    ids.
+    """
+
+    def group_key(book_id):
+        book_data = data[book_id]
+        source = book_data.get('source')
+        if not source or source == 'manual entry' or config.no_source:
+            source = ''
+        cover_id = get_path(book_data, '_extra', 'cover', 'id')
+        cover_type = ('' if not cover_id or config.no_covers
+                      else cover_id.split('_', 1)[0])
+        # Books added manually go last
+        return not source, source.casefold(), cover_type
+
+    book_ids = [book_id for book_id in config.book_ids or data
+                if book_id in data]
+    # Sorting is stable, so books keep their original order within a group
+    config.book_ids = sorted(book_ids, key=group_key)
+    groups = Counter(map(group_key, config.book_ids))
+    logger.info("Reordered %d books into %d groups by source",
+                len(book_ids), len(groups))
+    for (_, source, cover_type), count in groups.items():
+        logger.debug("%d books with source %r, cover type %r",
+                     count, source or 'manual entry', cover_type or None)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     add_common_flags(parser)
@@ -1513,10 +2526,45 @@ if __name__ == '__main__':
                        help="Set all books to public")
     parser.add_argument('--no-covers', action='store_true',
                         help="Don't set book covers")
+    parser.add_argument('--no-bulk-write', action='store_true',
+                        help="Type values into simple text fields one at a "
+                        "time instead of setting them all with a script")
+    parser.add_argument('--post', action='store_true',
+                        help="Add books without a source by submitting the "
+                        "add book form directly, when they don't use fields "
+                        "that need the browser")
+    parser.add_argument('--settle-time', type=int, default=200,
+                        help="Time in milliseconds for which a cover's "
+                        "location must be unchanged before it is clicked "
+                        "(default: 200)")
+    parser.add_argument('--group-by-source', action='store_true',
+                        help="Import books with the same source together, "
+                        "rather than in file order")
+    parser.add_argument('--phase', choices=PHASE_STEPS, default='all',
+                        help="Import step to run: 'create', create books "
+                        "with only a title and tag; 'edit', set the fields "
+                        "of created books; 'cover', set the covers of edited "
+                        "books; 'all', do all steps for each book (default). "
+                        "Requires --ledger-file unless 'all'")
+    parser.add_argument('--existing',
+                        help="JSON export of the library being imported "
+                        "into; books already in it are skipped")
+    parser.add_argument('--ledger-file',
+                        help="File in which to record the progress of each "
+                        "book, so that a re-run resumes partially imported "
+                        "books instead of adding them again")
+    parser.add_argument('--cache-file',
+                        help="File in which to cache lookup tables, such as "
+                        "language codes and source ids, between runs")
+    parser.add_argument('--cache-ttl', type=positive_int, default=30,
+                        help="Number of days after which cached lookup "
+                        "tables expire (default: 30)")
     parser.add_argument('file', help="File containing JSON book data.")
     parser.add_argument('extrafile', nargs='?',
                         help="Optional file containing extra book data")
     config = parser.parse_args()
+    if config.phase != 'all' and not config.ledger_file:
+        parser.error("--phase requires --ledger-file")
     init_logging(config, 'ltji')
     parse_book_ids(config)
     parse_search_by(config)
@@ -1524,5 +2572,17 @@ if __name__ == '__main__':
         data = json.load(f)
     if config.extrafile:
         add_extra_data(data, config.extrafile)
-    success = main(config, data)
+    if config.group_by_source:
+        group_books(config, data)
+    index = None
+    if config.existing:
+        with open(config.existing) as f:
+            index = LibraryIndex(json.load(f))
+    progress = {}
+    if config.ledger_file and os.path.exists(config.ledger_file):
+        for book_id, record in Journal.replay(config.ledger_file):
+            progress[book_id] = record
+    with (Journal(config.ledger_file, resume=True) if config.ledger_file
+          else nullcontext()) as ledger:
+        success = main(config, data, progress, ledger, index)
     exit(0 if success else 1)
@@ -0,0 +1,122 @@
+"""Tests of scraping book details over HTTP, against a local stub server."""
+import os
+import tempfile
+import threading
+import unittest
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from _common import Journal, http_session
+from ltje import LibraryThingHttpScraper
+
+DETAILS_PAGE = """\
+<html><body>
+<div id="bookedit_roles">
+  <div class="bookeditPerson"><span>Illustrator -</span><span>Doe, Jane</span>
+  </div>
+  <div class="bookeditPerson"><span>Roe, Richard</span></div>
+</div>
+<div id="bookedit_lang">English</div>
+<div id="bookedit_lang-data">eng</div>
+<div style="display: none"><div id="bookedit_lang2">French</div></div>
+<div id="bookedit_lang2-data">fre</div>
+<div id="bookedit_lang_original">German</div>
+<div id="bookedit_lang_original-data">ger</div>
+<div id="startedfinished"><table>
+  <tr id="xSF1"><td>2020-01-02</td><td>2020-02-03</td></tr>
+  <tr id="xSF2"><td></td><td>2021-05</td></tr>
+</table></div>
+<div id="bookedit_lexile">HL520L</div>
+<div id="bookedit_dewey" style="display:none">823.914</div>
+<div id="bookedit_summary" class="field autogeneratedText">Summary</div>
+<div class="xlocation"><a href="/venue/12345/Some-Bookshop">Some Bookshop</a>
+</div>
+<div id="maincover"><a href="#" onclick="si_info('am_0123456789'); return
+  false;"><img src="cover.jpg"></a></div>
+</body></html>
+"""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serve a saved book details page."""
+
+    def do_GET(self):
+        if self.path != '/work/100/details/200':
+            self.send_error(404)
+            return
+        body = DETAILS_PAGE.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpScraperTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.journal_file = os.path.join(tmp_dir.name, 'extra.journal')
+        self.journal = Journal(self.journal_file)
+        self.addCleanup(self.journal.close)
+        self.extra = {}
+
+    def scraper(self, no_covers=False):
+        config = Namespace(
+            base_url=f'http://127.0.0.1:{self.server.server_port}',
+            no_covers=no_covers)
+        session = http_session()
+        self.addCleanup(session.close)
+        return LibraryThingHttpScraper(config, session, self.extra,
+                                       self.journal)
+
+    def test_scrape_details(self):
+        book_data = {'title': 'A Title', 'workcode': '100'}
+        self.scraper().process_book('200', book_data)
+        self.assertEqual(self.extra['200']['_extra'], {
+            'secondary_authors': [
+                {'lf': 'Doe, Jane', 'role': 'Illustrator'},
+                {'lf': 'Roe, Richard'},
+            ],
+            'languages': {
+                'primary': {'name': 'English', 'code': 'eng'},
+                'original': {'name': 'German', 'code': 'ger'},
+            },
+            'reading_dates': [
+                {'started': '2020-01-02', 'finished': '2020-02-03'},
+                {'started': '', 'finished': '2021-05'},
+            ],
+            'lexile': 'HL520L',
+            'dewey': None,
+            'summary_autogenerated': True,
+            'from_where': {'name': 'Some Bookshop', 'venue_id': '12345'},
+            'cover': {'id': 'am_0123456789'},
+        })
+        self.journal.close()
+        self.assertEqual(
+            [book_id for book_id, _ in Journal.replay(self.journal_file)],
+            ['200'])
+
+    def test_no_covers(self):
+        book_data = {'title': 'A Title', 'workcode': '100'}
+        self.scraper(no_covers=True).process_book('200', book_data)
+        self.assertIsNone(self.extra['200']['_extra']['cover'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""Tests of adding books by form post, against a local stub server."""
+import threading
+import unittest
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl
+
+from ltji import LibraryThingImporter
+
+ADD_FORM = """\
+<html><body>
+<form method="post" action="/addnew.php">
+  <input type="hidden" name="formkey" value="abc123">
+  <input type="text" id="form_title" name="form_title" value="">
+  <select id="sortcharselector" name="sortcharselector">
+    <option value="999" selected>(none)</option>
+    <option value="4">4</option>
+  </select>
+  <input type="text" id="form_authorunflip" name="form_authorunflip">
+  <select id="person_role--1" name="person_role--1">
+    <option value="">Author</option>
+    <option value="editor">Editor</option>
+  </select>
+  <input type="text" id="form_tags" name="form_tags">
+  <input type="hidden" id="form_rating" name="form_rating" value="0">
+  <textarea id="form_review" name="form_review"></textarea>
+  <select id="mediatype" name="mediatype">
+    <option value="">(none)</option>
+    <option value="1.1">Paperback</option>
+  </select>
+  <input type="text" id="form_date" name="form_date">
+  <input type="text" id="form_comments" name="form_comments">
+  <textarea id="form_summary" name="form_summary"></textarea>
+  <input type="checkbox" id="collection_1" name="collection[]" value="1"
+         checked>
+  <input type="checkbox" id="collection_2" name="collection[]" value="2">
+  <input type="checkbox" id="books_private" name="books_private">
+  <input type="submit" name="Submit" value="Save">
+</form>
+</body></html>
+"""
+
+ADDED_BOOKS = """\
+<html><body><div id="bookframe"><div class="booklist">
+  <div class="book"><h2><a href="/work/11/book/22">New book</a></h2></div>
+  <div class="book"><h2><a href="/work/3/book/4">Old book</a></h2></div>
+</div></div></body></html>
+"""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serve the add book form, and record the forms submitted to it."""
+
+    def do_GET(self):
+        pages = {'/addnew.php': ADD_FORM, '/addbooks': ADDED_BOOKS}
+        if self.path not in pages:
+            self.send_error(404)
+            return
+        body = pages[self.path].encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.server.posts.append(
+            parse_qsl(self.rfile.read(length).decode(),
+                      keep_blank_values=True))
+        self.send_response(302)
+        self.send_header('Location', '/addbooks')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDriver:
+    """WebDriver with no cookies, for an HTTP-only session."""
+
+    def get_cookies(self):
+        return []
+
+
+class AddByPostTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), StubHandler)
+        cls.server.posts = []
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.posts.clear()
+        config = Namespace(
+            base_url=f'http://127.0.0.1:{self.server.server_port}',
+            tag='imported', summary='auto', private=False, public=False)
+        self.importer = LibraryThingImporter(config, FakeDriver(), {})
+        self.importer.collection_ids = {'Your library': 'collection_1',
+                                        'Wishlist': 'collection_2'}
+
+    def book(self, **fields):
+        book_data = {
+            'title': 'A Title',
+            'authors': [{'lf': 'Author, An', 'role': 'Editor'}],
+            'tags': ['fiction'],
+            'rating': 3.5,
+            'review': 'Good.',
+            'format': [{'code': '1.1', 'text': 'Paperback'}],
+            'date': '2001',
+            'collections': ['Wishlist'],
+            'public': '0',
+        }
+        book_data.update(fields)
+        return book_data
+
+    def test_submits_book_fields(self):
+        ids = self.importer.add_by_post('1', self.book())
+        self.assertEqual(ids, ('11', '22'))
+        [form] = self.server.posts
+        self.assertEqual(form, [
+            ('formkey', 'abc123'),
+            ('form_title', 'A Title'),
+            ('sortcharselector', '999'),
+            ('form_authorunflip', 'Author, An'),
+            ('person_role--1', 'editor'),
+            ('form_tags', 'fiction, imported'),
+            ('form_rating', '7'),
+            ('form_review', 'Good.'),
+            ('mediatype', '1.1'),
+            ('form_date', '2001'),
+            ('form_comments', ''),
+            ('form_summary', ''),
+            ('collection[]', '2'),
+            ('books_private', 'on'),
+        ])
+
+    def test_default_author_role(self):
+        book_data = self.book(authors=[{'lf': 'Author, An'}])
+        self.assertEqual(self.importer.add_by_post('1', book_data),
+                         ('11', '22'))
+        self.assertIn(('person_role--1', ''), self.server.posts[0])
+
+    def test_unknown_author_role(self):
+        book_data = self.book(authors=[{'lf': 'Author, An',
+                                        'role': 'Cartographer'}])
+        self.assertIsNone(self.importer.add_by_post('1', book_data))
+        self.assertEqual(self.server.posts, [])
+
+    def test_unknown_media_type(self):
+        book_data = self.book(format=[{'code': '1.3', 'text': 'Hardcover'}])
+        self.assertIsNone(self.importer.add_by_post('1', book_data))
+        self.assertEqual(self.server.posts, [])
+
+    def test_unknown_sort_character(self):
+        book_data = self.book(sortcharacter='9')
+        self.assertIsNone(self.importer.add_by_post('1', book_data))
+        self.assertEqual(self.server.posts, [])
+
+    def test_missing_form_field(self):
+        book_data = self.book(publication='Publisher')
+        self.assertIsNone(self.importer.add_by_post('1', book_data))
+        self.assertEqual(self.server.posts, [])
+
+
+if __name__ == '__main__':
+    unittest.main()